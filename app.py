@@ -1,14 +1,33 @@
+import os
 import json
-from flask import Flask, render_template, redirect, request
+import hashlib
+from flask import Flask, Response, render_template, redirect, request, stream_with_context
 
 import db
+import jobs
+import lineup
+import pubsub
+import search
+import lyricsearch
+import pagecache
 import extract
+import compiled
 
 CFG = {}
 with open("res/config.json", "rb") as cfg_file:
     CFG = json.load(cfg_file)
 
 db.initdb(CFG)
+jobs.init(CFG)
+lineup.init(CFG)
+lyricsearch.init(CFG, db.get_all_songs())
+
+def queue_exported(job):
+    # every finished export goes in the singer queue
+    madlib = db.get_madlib(job["madlib"])
+    lineup.enqueue(job["madlib"], madlib.get("singer_name", ""), madlib.get("song_name", ""), job["filen"])
+
+jobs.JOBS["on_done"].append(queue_exported)
 
 app = Flask(__name__)
 app.config["TEMPLATES_AUTO_RELOAD"] = True
@@ -17,44 +36,220 @@ app.config["TEMPLATES_AUTO_RELOAD"] = True
 def index():
     return render_template("index.html")
 
+# songs shown before anything is typed in the search box, the rest come from /api/search
+SONGLIST_PAGE = 50
+
 @app.route("/config")
 def config():
-    return render_template("songlist.html", mode="config", songs=db.get_all_songs())
+    return pagecache.cached_page(
+        ("songlist", "config", db.catalogue_version()),
+        lambda: songlist_page("config", db.get_all_songs()),
+    )
+
+def songlist_page(mode, songs):
+    return render_template("songlist.html", mode=mode, songs=songs[:SONGLIST_PAGE], has_more=len(songs) > SONGLIST_PAGE)
+
+PATCH_OPS = ("add", "replace", "remove")
+
+def patch_body_error(body):
+    # what's wrong with a PATCH body, None if nothing
+    if not isinstance(body, dict) or not isinstance(body.get("ops"), list):
+        return "body needs an \"ops\" list"
+    if not isinstance(body.get("version", 0), int):
+        return "\"version\" has to be a number"
+    for op in body["ops"]:
+        if not isinstance(op, dict) or op.get("op") not in PATCH_OPS or not isinstance(op.get("path"), str):
+            return f"bad op {op!r}"
+        if op["op"] != "remove" and "value" not in op:
+            return f"op {op['op']!r} needs a value"
+    return None
+
+def apply_patch(patch_fn, id):
+    # body is {"version": <version the ops were made against>, "ops": [...]}
+    body = request.get_json(silent=True)
+    error = patch_body_error(body)
+    if error is not None:
+        return { "status": 400, "error": error }, 400
+
+    try:
+        version = patch_fn(id, body["ops"], body.get("version", 0), source=request.headers.get("X-Client-Id"))
+    except db.VersionConflict as e:
+        return { "status": 409, "current": e.current }, 409
+    except db.MadlibNotFound:
+        return { "status": 404 }, 404
+    except ValueError as e:
+        return { "status": 400, "error": str(e) }, 400
+    return { "status": 200, "version": version }
 
-@app.route("/config/<song>", methods=["GET", "POST"])
+@app.route("/config/<song>", methods=["GET", "POST", "PATCH"])
 def config_song(song):
     if request.method == "POST":
-        db.write_template(song, request.get_json())
-        return { "status": 200 }
+        version = db.write_template(song, request.get_json(), source=request.headers.get("X-Client-Id"))
+        return { "status": 200, "version": version }
+    elif request.method == "PATCH":
+        return apply_patch(db.patch_template, song)
     elif request.method == "GET":
+        song_info = db.get_song(song)
+        if song_info is None:
+            return { "status": 404 }, 404
+
+        # the page loads the lyrics and the template from /api
+        return pagecache.cached_page(
+            ("config", song),
+            lambda: render_template("config.html", song=song_info),
+        )
+
+def event_stream(channel):
+    return Response(
+        stream_with_context(pubsub.stream(channel)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/config/<song>/events")
+def config_song_events(song):
+    # changes to the template as they're saved, see pubsub.diff for the format
+    return event_stream(f"template/{song}")
+
+# JSON api, responses are cached and compressed, and revalidate with etags like the pages
+
+@app.route("/api/songs")
+def api_songs():
+    def build():
+        return [
+            {"id": song["id"], "artist": song["artist"], "title": song["title"], "has_template": song["has_template"]}
+            for song in db.get_all_songs()
+        ]
+    return pagecache.cached_json(("api/songs", db.catalogue_version()), build)
+
+@app.route("/api/search")
+def api_search():
+    # ?q=<words>&page=1&per_page=50, mode=madlib only finds songs that have a template
+    page = request.args.get("page", 1, type=int)
+    per_page = min(max(1, request.args.get("per_page", SONGLIST_PAGE, type=int)), 500)
+    keep = None
+    if request.args.get("mode") == "madlib":
+        keep = lambda song: song["has_template"]
+
+    db.load_songs()
+    songs, total = search.search(request.args.get("q", ""), page, per_page, keep)
+    return {
+        "songs": [
+            {"id": song["id"], "artist": song["artist"], "title": song["title"], "has_template": song["has_template"]}
+            for song in songs
+        ],
+        "total": total,
+        "page": page,
+        "n_pages": max(1, -(-total // per_page)),
+    }
+
+@app.route("/api/lyrics/search")
+def api_lyrics_search():
+    # songs that sing every word in q at least min times, e.g. ?q=love&min=10
+    page = request.args.get("page", 1, type=int)
+    per_page = min(max(1, request.args.get("per_page", SONGLIST_PAGE, type=int)), 500)
+    results, total = lyricsearch.query(
+        request.args.get("q", ""), max(request.args.get("min", 1, type=int), 1), page, per_page,
+    )
+
+    for result in results:
+        song = db.get_song(result["song"])
+        result["artist"] = song["artist"] if song is not None else ""
+        result["title"] = song["title"] if song is not None else ""
+    return {
+        "songs": results,
+        "total": total,
+        "page": page,
+        "n_pages": max(1, -(-total // per_page)),
+    }
+
+@app.route("/api/songs/<song>/lyrics")
+def api_lyrics(song):
+    # lines of words, see compiled.lyric_columns for the layout
+    song_info = db.get_song(song)
+    if song_info is None:
+        return { "status": 404 }, 404
+
+    # only changes with the song file
+    try:
+        stat = os.stat(CFG["karaoke_dir"] + song_info["filen"])
+    except FileNotFoundError:
+        return { "status": 404 }, 404
+    return pagecache.cached_json(
+        ("api/lyrics", song, stat.st_mtime_ns, stat.st_size),
         # TODO: pass filen rather than song id
-        words, word_dict = extract.by_id(song).values()
-        existing_config = db.get_template_str(song)
-        return render_template("config.html", existing_config=existing_config, lyrics=words)
+        lambda: compiled.lyric_columns(compiled.by_id(song)["words"]),
+    )
+
+@app.route("/api/songs/<song>/suggestions")
+def api_suggestions(song):
+    # suggested blanks for the whole song, see compiled.suggest_template
+    song_info = db.get_song(song)
+    if song_info is None:
+        return { "status": 404 }, 404
+
+    try:
+        stat = os.stat(CFG["karaoke_dir"] + song_info["filen"])
+    except FileNotFoundError:
+        return { "status": 404 }, 404
+    return pagecache.cached_json(
+        ("api/suggestions", song, stat.st_mtime_ns, stat.st_size),
+        lambda: compiled.suggest_template([w for line in compiled.by_id(song)["words"] for w in line]),
+    )
+
+@app.route("/api/templates/<song>")
+def api_template(song):
+    template_str = db.get_template_str(song)
+    template_hash = hashlib.sha1(template_str.encode("utf-8")).hexdigest()
+    return pagecache.cached_json(("api/template", song, template_hash), lambda: json.loads(template_str))
 
 @app.route("/madlibs")
 def madliblist():
-    return render_template("madliblist.html", madlibs=db.get_madlibs())
+    page = request.args.get("page", 1, type=int)
+    per_page = max(1, request.args.get("per_page", 50, type=int))
+    sort = request.args.get("sort", "updated")
+    reverse = request.args.get("order", "desc") == "desc"
+
+    madlibs, total = db.list_madlibs(page, per_page, sort, reverse)
+    n_pages = max(1, -(-total // per_page))
+    return render_template(
+        "madliblist.html",
+        madlibs=madlibs,
+        page=page,
+        n_pages=n_pages,
+        per_page=per_page,
+        sort=sort,
+        order="desc" if reverse else "asc",
+    )
 
 @app.route("/madlib")
 def songlist():
-    return render_template("songlist.html", mode="madlib", songs=db.get_songs_with_templates())
+    return pagecache.cached_page(
+        ("songlist", "madlib", db.catalogue_version()),
+        lambda: songlist_page("madlib", db.get_songs_with_templates()),
+    )
 
 @app.route("/madlib/<song>")
 def madlib(song):
     id = db.madlib_create(song)
     return redirect(f"/madlib/edit/{id}")
 
-@app.route("/madlib/edit/<id>", methods=["GET", "POST"])
+@app.route("/madlib/edit/<id>", methods=["GET", "POST", "PATCH"])
 def madlib_edit(id):
     if request.method == "POST":
-        db.madlib_edit(id, request.get_json())
-        return { "status": 200 }
+        version = db.madlib_edit(id, request.get_json(), source=request.headers.get("X-Client-Id"))
+        return { "status": 200, "version": version }
+    elif request.method == "PATCH":
+        return apply_patch(db.madlib_patch, id)
     elif request.method == "GET":
         madlib_str = db.get_madlib_str(id)
         madlib = db.get_madlib(id)
         return render_template("edit.html", madlib=madlib, madlib_str=madlib_str)
 
+@app.route("/madlib/edit/<id>/events")
+def madlib_edit_events(id):
+    return event_stream(f"madlib/{id}")
+
 @app.route("/export/<id>", methods=["POST"])
 def export(id):
     if request.method != "POST":
@@ -73,11 +268,75 @@ def export(id):
         "id": madlib["id"],
     }    
 
-    extract.construct_madlib_file(out_filen_data, midi_filen, madlib["fillings"])
+    # exporting can take a while, hand it to the worker pool and let the page poll /export/status/<job_id>
+    try:
+        job = jobs.submit(out_filen_data, midi_filen, madlib["fillings"])
+    except jobs.QueueFull as e:
+        return { "status": 503, "error": str(e) }, 503
 
-    return { "status": 200 }
+    return { "status": 202, "job": job }, 202
+
+@app.route("/export/status/<job_id>")
+def export_status(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return { "status": 404 }, 404
+    return { "status": 200, "job": job }
 
 
 @app.route("/admin")
 def admin():
-    return f"manage queue, see all madlibs"
\ No newline at end of file
+    return render_template("admin.html", lineup=lineup.get_lineup())
+
+@app.route("/admin/stats")
+def admin_stats():
+    # hits/misses/evictions of the song cache (parsed and compiled songs) and the page cache
+    return {
+        "song_cache": extract.song_cache_stats(),
+        "page_cache": pagecache.stats(),
+    }
+
+# op -> fields it needs and what type they have to be
+LINEUP_OPS = {
+    "pop": {},
+    "skip": {"id": str},
+    "move": {"id": str, "position": int},
+    "enqueue": {"madlib": str},
+}
+
+def lineup_op_error(op):
+    # what's wrong with a POSTed lineup op, None if nothing
+    if not isinstance(op, dict) or op.get("op") not in LINEUP_OPS:
+        return f"op has to be one of {', '.join(LINEUP_OPS)}"
+    for field, kind in LINEUP_OPS[op["op"]].items():
+        # bool is an int too
+        if not isinstance(op.get(field), kind) or isinstance(op.get(field), bool):
+            return f"{op['op']} needs {field!r} ({kind.__name__})"
+    return None
+
+@app.route("/admin/lineup", methods=["GET", "POST"])
+def admin_lineup():
+    if request.method == "POST":
+        op = request.get_json(silent=True)
+        error = lineup_op_error(op)
+        if error is not None:
+            return { "status": 400, "error": error }, 400
+
+        if op["op"] == "pop":
+            lineup.pop()
+        elif op["op"] == "skip":
+            lineup.skip(op["id"])
+        elif op["op"] == "move":
+            lineup.move(op["id"], op["position"])
+        elif op["op"] == "enqueue":
+            madlib = db.get_madlib(op["madlib"])
+            if madlib == {}:
+                return { "status": 404 }, 404
+            lineup.enqueue(op["madlib"], madlib.get("singer_name", ""), madlib.get("song_name", ""))
+        return { "status": 200, "lineup": lineup.get_lineup() }
+    elif request.method == "GET":
+        # ?since=<version> holds the request until the lineup changes, so the host screen can just keep asking
+        since = request.args.get("since", type=int)
+        if since is None:
+            return lineup.get_lineup()
+        return lineup.wait(since, request.args.get("timeout", lineup.MAX_WAIT, type=float))
\ No newline at end of file
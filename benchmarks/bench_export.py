@@ -0,0 +1,46 @@
+# Export latency, full (parse, splice, re-export every track) vs patch (re-encode only the touched tracks).
+# Each song gets the same 8 fillings in both modes, the song cache is warm so only the export itself is timed.
+#
+#   python benchmarks/bench_export.py [karaoke dir, default res/midi/karaoke-files/]
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import extract
+from db import DB
+
+REPEAT = 5
+N_FILLINGS = 8
+
+def main():
+    karaoke_dir = sys.argv[1] if len(sys.argv) > 1 else "res/midi/karaoke-files/"
+    filens = sorted(
+        os.path.join(karaoke_dir, f) for f in os.listdir(karaoke_dir)
+        if os.path.splitext(f)[-1].lower() == ".kar"
+    )
+    DB["config"] = {}
+
+    madlibs = []
+    for filen in filens:
+        keys = sorted(extract.load_song(filen)["word_dict"])[:N_FILLINGS]
+        madlibs.append([{"baseWordKey": key, "replaceWith": "refrigerator"} for key in keys])
+
+    out_dir = tempfile.mkdtemp()
+    print(f"{len(filens)} songs, {N_FILLINGS} fillings each")
+    for mode in ("full", "patch"):
+        DB["config"]["export_mode"] = mode
+        best = None
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            for i, (filen, madlib) in enumerate(zip(filens, madlibs)):
+                ofd = {"dir": out_dir + "/", "title": "bench", "singer": "s", "author": "a", "id": str(i)}
+                extract.construct_madlib_file(ofd, filen, madlib)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{mode:<8}{best*1000:>10.1f}ms{best*1000/max(len(filens), 1):>10.2f}ms/song")
+
+if __name__ == '__main__':
+    main()
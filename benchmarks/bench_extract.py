@@ -0,0 +1,81 @@
+# Words/second for the lyric extraction hot path.
+#   generate_word_dict  MIDIFile parse + generate_word_dict (parse time not counted)
+#   iter_lyric_words    lyric-only extraction from bytes
+#   attr_code           just the attr key function
+#
+#   python benchmarks/bench_extract.py [karaoke dir, default res/midi/karaoke-files/]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import extract
+from MIDI import MIDIFile
+
+REPEAT = 5
+
+def best_of(fn):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        n = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return n, best
+
+def main():
+    karaoke_dir = sys.argv[1] if len(sys.argv) > 1 else "res/midi/karaoke-files/"
+    filens = sorted(
+        os.path.join(karaoke_dir, f) for f in os.listdir(karaoke_dir)
+        if os.path.splitext(f)[-1].lower() == ".kar"
+    )
+    bufs = []
+    for filen in filens:
+        with open(filen, "rb") as f:
+            bufs.append(f.read())
+
+    def generate_word_dict():
+        n = 0
+        for filen in filens:
+            midi = MIDIFile(filen)
+            midi.parse()
+            # generate_word_dict parses the tracks itself, so time only that
+            start = time.perf_counter()
+            _, words = extract.generate_word_dict(midi)
+            timings.append(time.perf_counter() - start)
+            n += len(words)
+        return n
+
+    def iter_lyric_words():
+        n = 0
+        for buf in bufs:
+            words = list(extract.iter_lyric_words(buf))
+            extract.count_syllables(words)
+            n += len(words)
+        return n
+
+    # warm up the hyphenator and its cache
+    iter_lyric_words()
+
+    best = None
+    for _ in range(REPEAT):
+        timings = []
+        n_words = generate_word_dict()
+        best = sum(timings) if best is None else min(best, sum(timings))
+    results = [("generate_word_dict", n_words, best)]
+
+    n, elapsed = best_of(iter_lyric_words)
+    results.append(("iter_lyric_words", n, elapsed))
+
+    samples = [w.word for w in extract.iter_lyric_words(bufs[0])] * 50 if bufs else []
+    n, elapsed = best_of(lambda: len([extract.attr_code(w) for w in samples]))
+    results.append(("attr_code", n, elapsed))
+
+    print(f"{len(filens)} songs")
+    print(f"{'':<20}{'words':>10}{'time':>12}{'words/s':>12}")
+    for name, n, elapsed in results:
+        print(f"{name:<20}{n:>10}{elapsed*1000:>10.1f}ms{n/max(elapsed, 1e-9):>12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Compares the dict tree Hyphenator against the packed array trie:
+# build/load time, memory, and words/second.
+#
+#   python benchmarks/bench_hyphenate.py
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import hyphenate
+from hyphenate import Hyphenator, PackedHyphenator
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, peak, retained
+
+def load_words():
+    dict_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'res', 'dict')
+    words = []
+    for filen in sorted(os.listdir(dict_dir)):
+        with open(os.path.join(dict_dir, filen), encoding='latin-1') as f:
+            for line in f:
+                words.extend(w.lower() for w in line.split() if w.isalpha())
+    return words
+
+def words_per_second(hyphenator, words, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for w in words:
+            # skip the memo cache, that's measured elsewhere
+            hyphenator._points(w)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(words) / best
+
+def main():
+    patterns, exceptions = hyphenate.patterns, hyphenate.exceptions
+    words = load_words()
+
+    tree, tree_time, tree_peak, tree_mem = measure(lambda: Hyphenator(patterns, exceptions))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'hyphenate.trie')
+        PackedHyphenator.from_hyphenator(tree).save(path)
+        size = os.path.getsize(path)
+        packed, packed_time, packed_peak, packed_mem = measure(lambda: PackedHyphenator.load(path))
+
+        mismatches = sum(1 for w in words if tree.hyphenate_word(w) != packed.hyphenate_word(w))
+
+        print(f"{'':<12}{'build/load':>12}{'peak mem':>12}{'retained':>12}{'words/s':>12}")
+        print(f"{'dict tree':<12}{tree_time*1000:>10.1f}ms{tree_peak/1024:>10.0f}kB{tree_mem/1024:>10.0f}kB{words_per_second(tree, words):>12.0f}")
+        print(f"{'packed':<12}{packed_time*1000:>10.1f}ms{packed_peak/1024:>10.0f}kB{packed_mem/1024:>10.0f}kB{words_per_second(packed, words):>12.0f}")
+        print(f"packed file: {size/1024:.0f}kB (mmapped, not counted above), {len(words)} words, {mismatches} mismatches")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Memory per song for the different ways of holding a song's words:
+#   words      list of Word objects (what generate_word_dict returns, without the midi events)
+#   packed     extract.SongWords, parallel arrays
+#
+#   python benchmarks/bench_memory.py [karaoke dir, default res/midi/karaoke-files/]
+import os
+import sys
+import gc
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import extract
+
+def allocated(fn):
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def main():
+    karaoke_dir = sys.argv[1] if len(sys.argv) > 1 else "res/midi/karaoke-files/"
+    filens = sorted(
+        os.path.join(karaoke_dir, f) for f in os.listdir(karaoke_dir)
+        if os.path.splitext(f)[-1].lower() == ".kar"
+    )
+
+    # read everything once up front so the hyphenator and interned strings aren't counted
+    bufs = []
+    for filen in filens:
+        with open(filen, "rb") as f:
+            bufs.append(f.read())
+    for buf in bufs:
+        extract.count_syllables(list(extract.iter_lyric_words(buf)))
+
+    def load_words():
+        songs = []
+        for buf in bufs:
+            words = list(extract.iter_lyric_words(buf))
+            extract.count_syllables(words)
+            for w in words:
+                # exports need the events, a song held for display doesn't
+                w.events = None
+            songs.append(words)
+        return songs
+
+    songs, words_size = allocated(load_words)
+    n_words = sum(len(words) for words in songs)
+    packed, packed_size = allocated(lambda: [extract.SongWords(words) for words in songs])
+
+    assert all(
+        [repr(w) for w in words] == [repr(w) for w in song_words]
+        for words, song_words in zip(songs, packed)
+    )
+
+    n = max(len(filens), 1)
+    print(f"{len(filens)} songs, {n_words} words")
+    print(f"{'':<8}{'total':>12}{'per song':>12}{'per word':>12}")
+    print(f"{'words':<8}{words_size/1024:>10.0f}kB{words_size/n/1024:>10.1f}kB{words_size/max(n_words, 1):>11.0f}B")
+    print(f"{'packed':<8}{packed_size/1024:>10.0f}kB{packed_size/n/1024:>10.1f}kB{packed_size/max(n_words, 1):>11.0f}B")
+
+if __name__ == '__main__':
+    main()
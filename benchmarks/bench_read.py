@@ -0,0 +1,69 @@
+# Compares ways of getting the lyrics out of a corpus of .kar files:
+#   midifile  MIDIFile(...).parse() + generate_word_dict (the old path)
+#   read      lyric-only extraction from the file read into bytes
+#   mmap      lyric-only extraction from a memory-mapped file
+# Each mode runs in its own process so peak RSS can be compared.
+#
+#   python benchmarks/bench_read.py [karaoke dir, default res/midi/karaoke-files/]
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+MODES = ("midifile", "read", "mmap")
+
+def run_mode(mode, filens):
+    import extract
+    from MIDI import MIDIFile
+
+    n_words = 0
+    start = time.perf_counter()
+    for filen in filens:
+        if mode == "midifile":
+            midi = MIDIFile(filen)
+            midi.parse()
+            _, words = extract.generate_word_dict(midi)
+        else:
+            _, words = extract.read_lyrics(filen, use_mmap=(mode == "mmap"))
+        n_words += len(words)
+    elapsed = time.perf_counter() - start
+
+    # kilobytes on linux, bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    return {"seconds": elapsed, "words": n_words, "peak_rss_kb": peak}
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--mode":
+        filens = json.loads(sys.stdin.read())
+        print(json.dumps(run_mode(sys.argv[2], filens)))
+        return
+
+    karaoke_dir = sys.argv[1] if len(sys.argv) > 1 else "res/midi/karaoke-files/"
+    filens = sorted(
+        os.path.join(karaoke_dir, f) for f in os.listdir(karaoke_dir)
+        if os.path.splitext(f)[-1].lower() == ".kar"
+    )
+    total_bytes = sum(os.path.getsize(filen) for filen in filens)
+    print(f"{len(filens)} files, {total_bytes/1024:.0f}kB")
+    print(f"{'mode':<10}{'time':>10}{'words':>10}{'peak rss':>12}")
+
+    for mode in MODES:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode],
+            input=json.dumps(filens), capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            print(f"{mode:<10} failed: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        r = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"{mode:<10}{r['seconds']*1000:>8.1f}ms{r['words']:>10}{r['peak_rss_kb']:>10}kB")
+
+if __name__ == '__main__':
+    main()
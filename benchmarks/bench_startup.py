@@ -0,0 +1,66 @@
+# Times `import app` (and the modules under it) in a fresh interpreter and
+# fails if it goes over the target, if importing builds the hyphenator, or if
+# an import fails outright. Run it from a directory with a res/config.json
+# (and the song index it points at), like the server:
+#
+#   python benchmarks/bench_startup.py [target seconds, default 0.5]
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULES = ("hyphenate", "db", "extract", "app")
+RUNS = 5
+
+PROBE = """
+import time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+import hyphenate
+print(json.dumps({{"elapsed": elapsed, "hyphenator_built": hyphenate._hyphenator is not None}}))
+"""
+
+def time_import(module):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (os.path.abspath(ROOT), env.get("PYTHONPATH")) if p)
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1]), None
+
+def main():
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    failed = False
+
+    for module in MODULES:
+        runs = []
+        for _ in range(RUNS):
+            probe, error = time_import(module)
+            if probe is None:
+                break
+            runs.append(probe)
+
+        if not runs:
+            # nothing got measured, so it can't pass
+            print(f"import {module:<10} failed ({error})")
+            failed = True
+            continue
+
+        best = min(run["elapsed"] for run in runs)
+        built = any(run["hyphenator_built"] for run in runs)
+        print(f"import {module:<10} {best*1000:8.1f}ms{'  (built the hyphenator!)' if built else ''}")
+        if built:
+            failed = True
+        if module == "app" and best > target:
+            print(f"import app took {best:.3f}s, target is {target:.3f}s")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import os
+import json
+import hashlib
+import threading
+
+import db
+import pos
+import extract
+from db import DB
+
+# Compiled lyric indexes live next to the song as <filen>.lyrics.json so opening a song doesn't need to parse the midi
+COMPILED_EXT = ".lyrics.json"
+# bump this whenever the layout below changes, old files will be recompiled
+COMPILED_VERSION = 1
+
+# one list per field, one entry per word (much smaller than a list of dicts)
+COLUMNS = (
+    "meta_type", "track_idx", "event_idxs", "word_idxs", "texts", "command",
+    "prenctuation", "word", "punctuation", "n_syllables", "attr", "is_last_in_line",
+)
+
+def compiled_filen(filen):
+    return filen + COMPILED_EXT
+
+def file_hash(filen):
+    h = hashlib.sha1()
+    with open(filen, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _source_info(filen):
+    stat = os.stat(filen)
+    return {
+        "hash": file_hash(filen),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+    }
+
+def write_compiled(filen, words, source=None):
+    if source is None:
+        source = _source_info(filen)
+
+    columns = {col: [] for col in COLUMNS}
+    for w in words:
+        columns["meta_type"].append(int(w.meta_type))
+        columns["track_idx"].append(w.track_idx)
+        columns["event_idxs"].append(w.event_idxs)
+        columns["word_idxs"].append(w.word_idxs)
+        columns["texts"].append(w.texts)
+        columns["command"].append(w.command.value)
+        columns["prenctuation"].append(w.prenctuation)
+        columns["word"].append(w.word)
+        columns["punctuation"].append(w.punctuation)
+        columns["n_syllables"].append(w.n_syllables)
+        columns["attr"].append(w.attr)
+        columns["is_last_in_line"].append(1 if w.is_last_in_line else 0)
+
+    compiled = {
+        "version": COMPILED_VERSION,
+        "source": source,
+        "words": columns,
+    }
+
+    # write then rename so a half written index is never picked up. Two requests (or preprocess workers)
+    # can compile the same song at once, so each gets its own tmp file
+    out_filen = compiled_filen(filen)
+    tmp_filen = f"{out_filen}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_filen, "w") as out_file:
+        json.dump(compiled, out_file, separators=(',', ':'))
+    os.replace(tmp_filen, out_filen)
+
+def compile_song(filen):
+    # only needs the lyrics, so skip parsing the rest of the midi. Parts of speech aren't saved, so don't tag
+    with extract.map_kar(filen) as buf:
+        words = list(extract.iter_lyric_words(buf))
+    extract.count_syllables(words)
+    write_compiled(filen, words)
+    return words
+
+def _is_fresh(filen, source):
+    stat = os.stat(filen)
+    if stat.st_mtime_ns == source["mtime_ns"] and stat.st_size == source["size"]:
+        return True
+    # mtime changes when files get copied around, only the contents matter
+    return stat.st_size == source["size"] and file_hash(filen) == source["hash"]
+
+def load_compiled(filen):
+    # the song's words as an extract.SongWords (indexing it gives Words without events),
+    # returns None if the song hasn't been compiled or the index is out of date
+    try:
+        with open(compiled_filen(filen), "r") as compiled_file:
+            compiled = json.load(compiled_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if compiled.get("version") != COMPILED_VERSION or not _is_fresh(filen, compiled["source"]):
+        return None
+
+    columns = compiled["words"]
+    return extract.SongWords(extract.Word.from_compiled(*row) for row in zip(*(columns[col] for col in COLUMNS)))
+
+# SongWords take up a few times the size of the .kar (see benchmarks/bench_memory.py), a rough guess
+COMPILED_SIZE_FACTOR = 6
+
+def load_cached(filen):
+    # the song's words as a SongWords, compiles the song first if it has to. Loaded songs go in
+    # extract.SONG_CACHE next to the parsed ones, so an open song isn't read and json parsed on every request
+    stat = os.stat(filen)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (filen, "compiled")
+
+    entry = extract.SONG_CACHE.get(cache_key, fresh=lambda entry: entry["key"] == key)
+    if entry is not None:
+        return entry["words"]
+
+    words = load_compiled(filen)
+    if words is None:
+        # not compiled yet, read the lyrics now and save the index for next time
+        words = extract.SongWords(compile_song(filen))
+
+    entry = {"key": key, "words": words, "size": stat.st_size * COMPILED_SIZE_FACTOR}
+    return extract.SONG_CACHE.put(cache_key, entry, entry["size"])["words"]
+
+def by_id(id):
+    song = db.get_song(id)
+    if song is None:
+        return None
+    filen = DB["config"]["karaoke_dir"] + song["filen"]
+
+    words = list(load_cached(filen))
+    # not saved in the index, the word lists can change without the song changing
+    extract.tag_parts_of_speech(words)
+
+    word_dict = {}
+    for w in words:
+        if w.attr not in word_dict:
+            word_dict[w.attr] = []
+        word_dict[w.attr].append(w)
+
+    return {
+        "words": extract.format_words(words),
+        "word_dict": word_dict,
+    }
+
+# what the browser needs of each word to show the lyrics
+LYRIC_COLUMNS = ("attr", "prenctuation", "word", "punctuation", "n_syllables")
+
+def lyric_columns(lines):
+    # lines from format_words as one list per field plus the number of words in each line,
+    # and the prompt suggested for each word ("" if it's not worth a blank)
+    words = [w for line in lines for w in line]
+    columns = {col: [getattr(w, col) for w in words] for col in LYRIC_COLUMNS}
+    columns["prompt"] = [pos.suggest_prompt(w.word, w.pos) or "" for w in words]
+    columns["line_lengths"] = [len(line) for line in lines]
+    return columns
+
+def suggest_template(words):
+    # one suggested blank per distinct word that's worth one, in the order they're first sung:
+    # [{"baseWordKey": attr, "prompt": ..., "syllables": n, "count": times it's sung}, ...]
+    suggestions = {}
+    for w in words:
+        if w.attr in suggestions:
+            suggestions[w.attr]["count"] += 1
+            continue
+        prompt = pos.suggest_prompt(w.word, w.pos) if w.word else None
+        if prompt is None:
+            continue
+        suggestions[w.attr] = {"baseWordKey": w.attr, "prompt": prompt, "syllables": w.n_syllables, "count": 1}
+    return list(suggestions.values())
@@ -1,24 +1,171 @@
 import os
+import copy
 import json
+import time
+import threading
 from uuid import uuid4 as uuid
 from base64 import b16encode
 
+import pubsub
+import search
+from sqlitedb import SQLiteStore
+
 DB = {}
+TEMPLATE_LOCK = threading.Lock()
+MADLIB_LOCK = threading.Lock()
+
+# fields copied from each madlib into the listing index
+MADLIB_SUMMARY_FIELDS = ("id", "song", "song_name", "singer_name", "author_name")
+MADLIB_SORTS = ("updated", "created", "song_name", "singer_name", "author_name")
+# edits that only bump the updated time get written out at most this often
+MADLIB_INDEX_FLUSH_DELAY = 5
+
+# one lock per madlib/template so a read-modify-write of a record can't interleave with another one
+RECORD_LOCKS = {}
+RECORD_LOCKS_LOCK = threading.Lock()
+# fields that patches aren't allowed to touch
+PROTECTED_FIELDS = ("id", "version")
+
+class VersionConflict(Exception):
+    # the record was saved by someone else since the version the patch was made against
+    def __init__(self, current):
+        super().__init__(f"record is at version {current.get('version', 0)}")
+        self.current = current
+
+class MadlibNotFound(Exception):
+    pass
 
 def initdb(CFG):
     DB["config"] = CFG
-    with open(DB["config"]["song_index"], "rb") as json_file:
-        DB["songs"] = [song for song in json.load(json_file) if not "hidden" in song]
+    DB["songs_version"] = 0
+    DB["songs_source"] = None
+
+    # "json" keeps everything in files under res/, "sqlite" keeps it all in one database
+    DB["store"] = None
+    if CFG.get("storage", "json") == "sqlite":
+        DB["store"] = SQLiteStore(CFG.get("sqlite_path", "res/madlibs.db"))
+
+    DB["songs_with_templates"] = None
+    load_templates()
+    load_songs()
+    load_madlib_index()
+
+    if CFG.get("watch_templates", 0) > 0:
+        watch_templates(CFG["watch_templates"])
 
-        for song in DB["songs"]:
-            template_filen = f'{DB["config"]["madlib_template_dir"]}{song["id"]}.json'
-            if os.path.isfile(template_filen):
-                song["has_template"] = True
-            else:
-                song["has_template"] = False
+def load_songs():
+    # (re)read the song index, only does any work when it has changed since last time
+    if DB["store"] is not None:
+        source = DB["store"].songs_version()
+    else:
+        source = os.stat(DB["config"]["song_index"]).st_mtime_ns
+    if source == DB["songs_source"]:
+        return
+
+    if DB["store"] is not None:
+        songs = [song for song in DB["store"].get_songs() if not "hidden" in song]
+    else:
+        with open(DB["config"]["song_index"], "rb") as json_file:
+            songs = [song for song in json.load(json_file) if not "hidden" in song]
+
+    with TEMPLATE_LOCK:
+        for song in songs:
+            song["has_template"] = song["id"] in DB["templates"]
+
+    DB["songs"] = songs
+    DB["songs_source"] = source
+    _reindex_songs()
+
+def _reindex_songs():
+    # swap in whole new structures so requests in flight keep a consistent view
+    DB["songs_by_id"] = {song["id"]: song for song in DB["songs"]}
+    DB["songs_by_artist"] = sorted(DB["songs"], key=lambda x: x["artist"])
+    DB["songs_version"] += 1
+    DB["songs_with_templates"] = None
+    search.build_index(DB["songs_by_artist"])
+
+def is_empty_template(template):
+    # the version number on its own doesn't make a template
+    return all(key == "version" for key in template)
+
+def _template_is_empty(template_filen):
+    try:
+        with open(template_filen, 'r') as template_file:
+            return is_empty_template(json.load(template_file))
+    except (FileNotFoundError, ValueError):
+        return True
+
+def load_templates():
+    # index of song ids that have a non-empty template, kept up to date by write_template (and watch_templates)
+    DB["templates"] = set()
+    DB["template_mtimes"] = {}
+    DB["templates_version"] = 0
+    scan_templates()
+
+def scan_templates():
+    # pick up templates that were added, changed or removed behind our back. only re-reads files whose mtime changed
+    if DB["store"] is not None:
+        template_ids = DB["store"].template_ids()
+        with TEMPLATE_LOCK:
+            for song_id in DB["templates"] ^ template_ids:
+                _set_has_template(song_id, song_id in template_ids)
+            DB["templates_version"] += 1
+            DB["songs_with_templates"] = None
+        return
+
+    template_dir = DB["config"]["madlib_template_dir"]
+    mtimes = {}
+    for entry in os.scandir(template_dir):
+        song_id, ext = os.path.splitext(entry.name)
+        if ext == '.json' and entry.is_file():
+            mtimes[song_id] = entry.stat().st_mtime_ns
+
+    changed = False
+    with TEMPLATE_LOCK:
+        for song_id in DB["template_mtimes"].keys() - mtimes.keys():
+            DB["templates"].discard(song_id)
+            changed = True
+
+        for song_id, mtime in mtimes.items():
+            if DB["template_mtimes"].get(song_id) == mtime:
+                continue
+            _set_has_template(song_id, not _template_is_empty(f'{template_dir}{song_id}.json'))
+            changed = True
+
+        DB["template_mtimes"] = mtimes
+        if changed:
+            DB["templates_version"] += 1
+            DB["songs_with_templates"] = None
+
+def _set_has_template(song_id, has_template):
+    # call with TEMPLATE_LOCK held
+    if has_template:
+        DB["templates"].add(song_id)
+    else:
+        DB["templates"].discard(song_id)
+
+    song = DB.get("songs_by_id", {}).get(song_id)
+    if song is not None:
+        song["has_template"] = has_template
+
+def watch_templates(interval):
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                scan_templates()
+            except OSError as e:
+                print(f"Template watcher: {e}")
+
+    watcher = threading.Thread(target=watch, name="template-watcher", daemon=True)
+    watcher.start()
+    return watcher
 
 
 def get_template_str(song_id):
+    if DB["store"] is not None:
+        return DB["store"].get_template_str(song_id)
+
     template_filen = f'{DB["config"]["madlib_template_dir"]}{song_id}.json'
     out = "{}"
     try:
@@ -28,11 +175,76 @@ def get_template_str(song_id):
         pass # nbd just return "{}"
     return out
 
-def write_template(song_id, new_json):
+def _publish_changes(channel, old, new, source):
+    # push what changed to anyone watching the record, source is whoever made the change so they can skip their own
+    if pubsub.has_subscribers(channel):
+        _publish_ops(channel, pubsub.diff(old, new), source)
+
+def _publish_ops(channel, ops, source):
+    if len(ops) > 0:
+        pubsub.publish(channel, {"op": "patch", "ops": ops, "source": source})
+
+def _record_lock(key):
+    with RECORD_LOCKS_LOCK:
+        lock = RECORD_LOCKS.get(key)
+        if lock is None:
+            lock = RECORD_LOCKS[key] = threading.Lock()
+        return lock
+
+def _patched(old, ops, version):
+    # copy of old with the ops applied and the version bumped
+    if old.get("version", 0) != version:
+        raise VersionConflict(old)
+    for op in ops:
+        root = op.get("path", "").split('/')[1:2]
+        if len(root) == 0 or root[0] in PROTECTED_FIELDS:
+            raise ValueError(f"can't patch {op.get('path')!r}")
+    new = pubsub.apply_patch(copy.deepcopy(old), ops)
+    new["version"] = old.get("version", 0) + 1
+    return new
+
+def write_template(song_id, new_json, source=None):
+    # saves the whole template (last write wins), returns the new version
+    old, new = _update_template(song_id, lambda old: dict(new_json, version=old.get("version", 0) + 1))
+    _publish_changes(f"template/{song_id}", old, new, source)
+    return new["version"]
+
+def patch_template(song_id, ops, version, source=None):
+    # applies JSON-patch style ops (see pubsub.apply_patch) to the template if it's still at version,
+    # otherwise raises VersionConflict. Returns the new version
+    _, new = _update_template(song_id, lambda old: _patched(old, ops, version))
+    _publish_ops(f"template/{song_id}", ops + [{"op": "replace", "path": "/version", "value": new["version"]}], source)
+    return new["version"]
+
+def _update_template(song_id, update):
+    # update(old template) -> new template, nothing else can save this template in between. Returns (old, new)
+    with _record_lock(f"template/{song_id}"):
+        if DB["store"] is not None:
+            old, new = DB["store"].update_template(song_id, update)
+        else:
+            old = get_template(song_id)
+            new = update(old)
+            _write_template(song_id, new)
+
+    with TEMPLATE_LOCK:
+        had_template = song_id in DB["templates"]
+        _set_has_template(song_id, not is_empty_template(new))
+        if had_template != (song_id in DB["templates"]):
+            DB["templates_version"] += 1
+            DB["songs_with_templates"] = None
+    return old, new
+
+def _write_template(song_id, new_json):
     template_filen = f'{DB["config"]["madlib_template_dir"]}{song_id}.json'
-    with open(template_filen, 'w') as template_file:
+    tmp_filen = f'{template_filen}.{threading.get_ident()}.tmp'
+    with open(tmp_filen, 'w') as template_file:
         json.dump(new_json, template_file)
 
+    with TEMPLATE_LOCK:
+        # rename is atomic so readers see either the old or the new template, never half of one
+        os.replace(tmp_filen, template_filen)
+        DB["template_mtimes"][song_id] = os.stat(template_filen).st_mtime_ns
+
 def get_template(song_id):
     template_str = get_template_str(song_id)
     return json.loads(template_str)
@@ -41,39 +253,141 @@ def get_config():
     return DB["config"]
 
 def get_song(id):
-    for song in get_all_songs():
-        if song["id"] == id:
-            return song
-    return None
+    return DB["songs_by_id"].get(id)
 
 def get_all_songs():
-    return sorted(DB["songs"], key=lambda x: x["artist"])
-    # return DB["songs"]
+    # already sorted by artist, don't modify it
+    load_songs()
+    return DB["songs_by_artist"]
+
+def catalogue_version():
+    # changes whenever the song list or which songs have templates changes
+    load_songs()
+    return (DB["songs_source"], DB["songs_version"], DB["templates_version"])
 
 def get_songs_with_templates():
     all_songs = get_all_songs()
-    songs = []
-    for song in all_songs:
-        if get_template(song["id"]) == {}:
-            continue
-        else:
-            songs.append(song)
-    return songs
+    with TEMPLATE_LOCK:
+        if DB["songs_with_templates"] is None:
+            DB["songs_with_templates"] = [song for song in all_songs if song["id"] in DB["templates"]]
+        return DB["songs_with_templates"]
 
 def get_madlibs():
-    madlib_dir = f'{DB["config"]["filled_madlib_dir"]}'
-    madlibs_filens = [
-        os.path.join(madlib_dir, f) for f in os.listdir(madlib_dir) if 
-            os.path.isfile(os.path.join(madlib_dir, f)) 
-            and os.path.splitext(f)[-1] == '.json'
-    ]
+    # loads every madlib in full, use list_madlibs for listing them
+    if DB["store"] is not None:
+        return DB["store"].get_madlibs()
 
     madlibs = []
-    for filen in madlibs_filens:
+    for filen in _madlib_ids_on_disk().values():
         with open(filen) as file:
             madlibs.append(json.load(file))
     return madlibs
 
+def _madlib_index_filen():
+    return DB["config"].get("madlib_index", "res/madlib_index.json")
+
+def _madlib_ids_on_disk():
+    madlib_dir = DB["config"]["filled_madlib_dir"]
+    return {
+        os.path.splitext(f)[0]: os.path.join(madlib_dir, f) for f in os.listdir(madlib_dir) if
+            os.path.splitext(f)[-1] == '.json'
+            and os.path.isfile(os.path.join(madlib_dir, f))
+    }
+
+def _summarize_madlib(madlib, created, updated):
+    # a patch can leave a field null (or not a string), the listing sorts on these
+    summary = {field: str(madlib.get(field) or "") for field in MADLIB_SUMMARY_FIELDS}
+    summary["created"] = created
+    summary["updated"] = updated
+    return summary
+
+def load_madlib_index():
+    # summary of every madlib so /madlibs doesn't have to open all of them
+    DB["madlib_index"] = {}
+    DB["madlib_index_dirty"] = False
+    DB["madlib_index_timer"] = None
+    DB["madlib_sorted"] = {}
+    if DB["store"] is not None:
+        # the database is its own index
+        return
+
+    try:
+        with open(_madlib_index_filen(), 'r') as index_file:
+            DB["madlib_index"] = {summary["id"]: summary for summary in json.load(index_file)}
+    except (FileNotFoundError, ValueError):
+        pass
+
+    # only madlibs that aren't in the index (or first run, or someone copied files in) get opened
+    on_disk = _madlib_ids_on_disk()
+    changed = False
+    for madlib_id in DB["madlib_index"].keys() - on_disk.keys():
+        del DB["madlib_index"][madlib_id]
+        changed = True
+    for madlib_id in on_disk.keys() - DB["madlib_index"].keys():
+        with open(on_disk[madlib_id]) as file:
+            madlib = json.load(file)
+        mtime = os.path.getmtime(on_disk[madlib_id])
+        DB["madlib_index"][madlib_id] = _summarize_madlib(madlib, madlib.get("created", mtime), mtime)
+        changed = True
+
+    if changed:
+        with MADLIB_LOCK:
+            _write_madlib_index()
+
+def _write_madlib_index():
+    # call with MADLIB_LOCK held
+    index_filen = _madlib_index_filen()
+    tmp_filen = f'{index_filen}.tmp'
+    with open(tmp_filen, 'w') as index_file:
+        json.dump(list(DB["madlib_index"].values()), index_file)
+    os.replace(tmp_filen, index_filen)
+    DB["madlib_index_dirty"] = False
+
+def flush_madlib_index():
+    with MADLIB_LOCK:
+        DB["madlib_index_timer"] = None
+        if DB["madlib_index_dirty"]:
+            _write_madlib_index()
+
+def _index_madlib(madlib):
+    now = time.time()
+    with MADLIB_LOCK:
+        old = DB["madlib_index"].get(madlib["id"])
+        created = old["created"] if old is not None else madlib.get("created", now)
+        summary = _summarize_madlib(madlib, created, now)
+        DB["madlib_index"][madlib["id"]] = summary
+        DB["madlib_sorted"] = {}
+
+        if old is None or any(old[field] != summary[field] for field in MADLIB_SUMMARY_FIELDS):
+            _write_madlib_index()
+        else:
+            # just typing in the fillings, no need to rewrite the index every keystroke
+            DB["madlib_index_dirty"] = True
+            if DB["madlib_index_timer"] is None:
+                DB["madlib_index_timer"] = threading.Timer(MADLIB_INDEX_FLUSH_DELAY, flush_madlib_index)
+                DB["madlib_index_timer"].daemon = True
+                DB["madlib_index_timer"].start()
+
+def list_madlibs(page=1, per_page=50, sort="updated", reverse=True):
+    # returns (summaries on this page, total number of madlibs)
+    if sort not in MADLIB_SORTS:
+        sort = "updated"
+    if DB["store"] is not None:
+        return DB["store"].list_madlibs(page, per_page, sort, reverse)
+
+    with MADLIB_LOCK:
+        key = (sort, reverse)
+        if key not in DB["madlib_sorted"]:
+            DB["madlib_sorted"][key] = sorted(
+                DB["madlib_index"].values(),
+                key=lambda summary: summary[sort].lower() if sort in MADLIB_SUMMARY_FIELDS else summary[sort],
+                reverse=reverse,
+            )
+        summaries = DB["madlib_sorted"][key]
+
+    start = (max(page, 1) - 1) * per_page
+    return summaries[start:start + per_page], len(summaries)
+
 def madlib_create(song_id):
     madlib_id = b16encode(uuid().bytes).decode("ascii").lower()
     template = get_template(song_id)
@@ -94,20 +408,57 @@ def madlib_create(song_id):
         "singer_name": "",
         "author_name": "",
         "fillings": fillings,
+        "created": time.time(),
     }
 
-    madlib_filen = f'{DB["config"]["filled_madlib_dir"]}{madlib_id}.json'
-    with open(madlib_filen, 'w') as madlib_file:
-        json.dump(madlib_entry, madlib_file)
+    _write_madlib(madlib_entry)
     
     return madlib_id
 
-def madlib_edit(madlib_id, madlib):
-    madlib_filen = f'{DB["config"]["filled_madlib_dir"]}{madlib_id}.json'
-    with open(madlib_filen, 'w') as madlib_file:
+def madlib_edit(madlib_id, madlib, source=None):
+    # saves the whole madlib (last write wins), returns the new version
+    old, new = _update_madlib(madlib_id, lambda old: dict(madlib, id=madlib_id, version=old.get("version", 0) + 1))
+    _publish_changes(f"madlib/{madlib_id}", old, new, source)
+    return new["version"]
+
+def madlib_patch(madlib_id, ops, version, source=None):
+    # applies JSON-patch style ops (see pubsub.apply_patch) to the madlib if it's still at version,
+    # otherwise raises VersionConflict (MadlibNotFound if there's no such madlib). Returns the new version
+    def update(old):
+        if old == {}:
+            raise MadlibNotFound(madlib_id)
+        return _patched(old, ops, version)
+
+    _, new = _update_madlib(madlib_id, update)
+    _publish_ops(f"madlib/{madlib_id}", ops + [{"op": "replace", "path": "/version", "value": new["version"]}], source)
+    return new["version"]
+
+def _update_madlib(madlib_id, update):
+    # update(old madlib) -> new madlib, nothing else can save this madlib in between. Returns (old, new)
+    with _record_lock(f"madlib/{madlib_id}"):
+        if DB["store"] is not None:
+            return DB["store"].update_madlib(madlib_id, update)
+        old = get_madlib(madlib_id)
+        new = update(old)
+        _write_madlib(new)
+        return old, new
+
+def _write_madlib(madlib):
+    if DB["store"] is not None:
+        DB["store"].write_madlib(madlib)
+        return
+
+    madlib_filen = f'{DB["config"]["filled_madlib_dir"]}{madlib["id"]}.json'
+    tmp_filen = f'{madlib_filen}.{threading.get_ident()}.tmp'
+    with open(tmp_filen, 'w') as madlib_file:
         json.dump(madlib, madlib_file)
+    os.replace(tmp_filen, madlib_filen)
+    _index_madlib(madlib)
 
 def get_madlib_str(id):
+    if DB["store"] is not None:
+        return DB["store"].get_madlib_str(id)
+
     madlib_filen = f'{DB["config"]["filled_madlib_dir"]}{id}.json'
     out = "{}"
     try:
@@ -1,9 +1,18 @@
 from enum import Enum, IntEnum
+from collections import namedtuple
+from contextlib import contextmanager
+import array
+import sys
+import copy
+import mmap
+import os
 import re
 import json
 
 from db import DB
-from hyphenate import hyphenate_word
+from hyphenate import hyphenate_word, syllable_counts
+from pos import lookup as pos_lookup
+from lru import LRUCache
 
 from MIDI import MIDIFile, Events
 
@@ -26,28 +35,57 @@ class MetaType(IntEnum):
     Lyric = 5
 
 ATTR_ALLOWED = "1234567890qwertyuiopasdfghjklzxcvbnmQWERTYUIOPASDFGHJKLZXCVBNM-_"
+
+class _AttrTable(dict):
+    # str.translate table: allowed characters map to themselves, anything else turns into '_'
+    def __missing__(self, c):
+        self[c] = '_'
+        return '_'
+
+ATTR_TABLE = _AttrTable((ord(c), c) for c in ATTR_ALLOWED)
+
 def attr_code(text):
-    safe = ""
-    for c in text.lower():
-        if c not in ATTR_ALLOWED:
-            safe += '_'
-        else:
-            safe += c
-    return safe
+    return text.lower().translate(ATTR_TABLE)
+
+# the first run of letters is the word, anything after it is punctuation
+WORD_RE = re.compile(r"[a-zA-Z']+")
+# KarCommand characters, stripped out of text words
+COMMAND_CHARS = str.maketrans('', '', '\\/ ')
+
+def split_word(text):
+    # same as taking the first non-empty piece of re.split(r"([a-zA-Z']+)", text) as the word and joining the rest
+    match = WORD_RE.match(text)
+    if match is None:
+        match = WORD_RE.search(text)
+        word = text[:match.start()] if match is not None else text
+    else:
+        word = match.group()
+    return word, text[len(word):]
 
 class Word:
     # word is a fucked up word if you keep typing it enough
-    def __init__(self, meta_type, events, track_idx, event_idxs, word_in_event_idxs):
+    __slots__ = (
+        "meta_type", "events", "track_idx", "event_idxs", "word_idxs", "texts", "is_last_in_line",
+        "command", "prenctuation", "word", "punctuation", "n_syllables", "attr", "pos",
+    )
+
+    def __init__(self, meta_type, events, track_idx, event_idxs, word_in_event_idxs, count_syllables=True, texts=None):
         self.meta_type = meta_type
         self.events = events
         self.track_idx = track_idx
         self.event_idxs = event_idxs
         self.word_idxs = word_in_event_idxs
 
-        self.texts = []
-        self._generate_texts()
+        # texts can be passed in by whoever already decoded and split the events (see _track_words)
+        if texts is not None:
+            self.texts = texts
+        else:
+            self.texts = []
+            self._generate_texts()
 
         self.is_last_in_line = False
+        # left as None until something that needs it tags the whole song, see tag_parts_of_speech
+        self.pos = None
 
         if self.meta_type == MetaType.Text:
             try:
@@ -55,7 +93,7 @@ class Word:
             except:
                 self.command = KarCommand.UnknownCommand
             
-            combined_text = re.sub(r"[\\\/ ]", '', "".join(self.texts))
+            combined_text = "".join(self.texts).translate(COMMAND_CHARS)
 
             if len(combined_text) == 0:
                 self.prenctuation = ""
@@ -70,9 +108,7 @@ class Word:
                     self.prenctuation = combined_text[0]
                     combined_text = combined_text[1:]
 
-                split_text = [s for s in re.split(r"([a-zA-Z']+)", combined_text) if len(s) > 0]
-                self.word = split_text[0]
-                self.punctuation = "".join(split_text[1:])
+                self.word, self.punctuation = split_word(combined_text)
                 self.attr = attr_code(self.word)
         elif self.meta_type == MetaType.Lyric:
             self.command = KarCommand.NoCommand
@@ -83,15 +119,38 @@ class Word:
                 self.prenctuation = combined_text[0]
                 combined_text = combined_text[1:]
 
-            split_text = [s for s in re.split(r"([a-zA-Z']+)", combined_text) if len(s) > 0]
-            self.punctuation = "".join(split_text[1:])
-            self.word = split_text[0]
+            self.word, self.punctuation = split_word(combined_text)
 
             self.attr = attr_code(self.word)
         else:
             print("Unknown meta type in word")
+
+        # the same few words show up over and over across songs, share the strings
+        self.word = sys.intern(self.word)
+        self.attr = sys.intern(self.attr)
         
-        self.n_syllables = len(hyphenate_word(self.word))
+        # left as None when the whole song gets counted at once, see count_syllables
+        self.n_syllables = len(hyphenate_word(self.word)) if count_syllables else None
+
+    @classmethod
+    def from_compiled(cls, meta_type, track_idx, event_idxs, word_idxs, texts, command, prenctuation, word, punctuation, n_syllables, attr, is_last_in_line):
+        # Rebuild a word from a compiled lyric index, there are no events so it can't be used for exporting
+        self = cls.__new__(cls)
+        self.meta_type = MetaType(meta_type)
+        self.events = None
+        self.track_idx = track_idx
+        self.event_idxs = event_idxs
+        self.word_idxs = word_idxs
+        self.texts = texts
+        self.is_last_in_line = is_last_in_line
+        self.command = KarCommand(command)
+        self.prenctuation = prenctuation
+        self.word = word
+        self.punctuation = punctuation
+        self.n_syllables = n_syllables
+        self.attr = attr
+        self.pos = None
+        return self
 
     def _generate_texts(self):
         texts = []
@@ -105,12 +164,12 @@ class Word:
                 if text[0] == ' ':
                     parts = parts[1:]
                 
-                texts.append(parts[self.word_idxs[i]])
+                texts.append(sys.intern(parts[self.word_idxs[i]]))
             elif self.meta_type == MetaType.Lyric:
                 if text[0] == ' ':
-                    texts.append(text[1:])
+                    texts.append(sys.intern(text[1:]))
                 else:
-                    texts.append(text)
+                    texts.append(sys.intern(text))
             else:
                 print("Unknown meta type in word")
 
@@ -129,6 +188,89 @@ class Word:
         else:
             return "<WORD WITH UNKNOWN META TYPE>"
 
+KAR_COMMANDS = list(KarCommand)
+
+class SongWords:
+    # All of a song's words packed into parallel arrays (one entry per word) instead of one object each,
+    # for keeping lots of songs in memory. Strings are interned, so repeated words cost one pointer.
+    # Indexing or iterating gives back Word objects (without events) for format_words and the templates.
+    # Per-event fields (event idx, word-in-event idx, text) are flat with word i's in [event_first[i], event_first[i+1])
+    __slots__ = (
+        "meta_type", "track_idx", "first_event", "last_event", "n_syllables", "attr_id", "command", "flags",
+        "attrs", "prenctuation", "word", "punctuation", "event_first", "event_idxs", "word_idxs", "texts",
+    )
+
+    def __init__(self, words=()):
+        self.meta_type = array.array("B")
+        self.track_idx = array.array("H")
+        self.first_event = array.array("I")
+        self.last_event = array.array("I")
+        self.n_syllables = array.array("H")
+        self.attr_id = array.array("I")
+        self.command = array.array("B")
+        self.flags = array.array("B")
+
+        self.attrs = []
+        self.prenctuation = []
+        self.word = []
+        self.punctuation = []
+
+        self.event_first = array.array("I", [0])
+        self.event_idxs = array.array("I")
+        self.word_idxs = array.array("H")
+        self.texts = []
+
+        attr_ids = {}
+        for w in words:
+            self.append(w, attr_ids)
+
+    def append(self, w, attr_ids=None):
+        if attr_ids is None:
+            attr_ids = {attr: i for i, attr in enumerate(self.attrs)}
+        if w.attr not in attr_ids:
+            attr_ids[w.attr] = len(self.attrs)
+            self.attrs.append(sys.intern(w.attr))
+
+        self.meta_type.append(int(w.meta_type))
+        self.track_idx.append(w.track_idx)
+        self.first_event.append(w.event_idxs[0])
+        self.last_event.append(w.event_idxs[-1])
+        self.n_syllables.append(w.n_syllables or 0)
+        self.attr_id.append(attr_ids[w.attr])
+        self.command.append(KAR_COMMANDS.index(w.command))
+        self.flags.append(1 if w.is_last_in_line else 0)
+
+        self.prenctuation.append(sys.intern(w.prenctuation))
+        self.word.append(sys.intern(w.word))
+        self.punctuation.append(sys.intern(w.punctuation))
+
+        self.event_idxs.extend(w.event_idxs)
+        # lyric words only have one word idx no matter how many events they span
+        self.word_idxs.extend((list(w.word_idxs) + [0] * len(w.event_idxs))[:len(w.event_idxs)])
+        self.texts.extend(sys.intern(t) for t in w.texts)
+        self.event_first.append(len(self.event_idxs))
+
+    def __len__(self):
+        return len(self.meta_type)
+
+    def __getitem__(self, i):
+        lo = self.event_first[i]
+        hi = self.event_first[i+1]
+        meta_type = MetaType(self.meta_type[i])
+        word_idxs = list(self.word_idxs[lo:hi])
+        if meta_type == MetaType.Lyric:
+            word_idxs = word_idxs[:1]
+
+        return Word.from_compiled(
+            meta_type, self.track_idx[i], list(self.event_idxs[lo:hi]), word_idxs, self.texts[lo:hi],
+            KAR_COMMANDS[self.command[i]].value, self.prenctuation[i], self.word[i], self.punctuation[i],
+            self.n_syllables[i], self.attrs[self.attr_id[i]], bool(self.flags[i]),
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 def generate_word_dict(midi):
     word_dict = {}
     words = []
@@ -136,87 +278,257 @@ def generate_word_dict(midi):
     for i, track in enumerate(midi):
         track.parse()
 
-        word_events = []
-        word_event_jndices = []
-        word_event_kndices = []
-        for j, event in enumerate(track):
-            if isinstance(event, Events.MetaEvent):
-                if event.type not in (MetaType.Text, MetaType.Lyric):
-                    # Ignore all events that don't contain text
-                    continue
-
-                text = event.data.decode('utf-8')
-                if len(text) == 0:
-                    continue
-                    
-                if event.type == MetaType.Text:
-                    # Metadata, ignore
-                    if text[0] == KarTag.TagIdentifier:
-                        continue
-                    else:
-                        # Each syllable gets its own event, may need to combine multiple events into 1 word
-                        # But also a single event might contain multiple words
-
-                        # In this case, the event contains multiple words
-                        words_in_event = []
-                        words_in_event = text.split(' ')
-                        words_in_event = [words_in_event[0]] + [' ' + part for part in words_in_event[1:]]
-                        if text[0] == ' ':
-                            words_in_event = words_in_event[1:]
-
-                        for k, _text in enumerate(words_in_event):
-                            # This should always be the case except when processing the first event
-                            if len(word_events) > 0:
-                                if _text[0] not in (' ', '\\', '/'):
-                                    # Continuation of word from a previous event
-                                    word_events.append(event)
-                                    word_event_jndices.append(j)
-                                    word_event_kndices.append(k)
-                                    continue
-                                else:
-                                    # New word, process previous one
-                                    w = Word(MetaType.Text, word_events, i, word_event_jndices, word_event_kndices)
-                                    words.append(w)
-                                    if w.attr not in word_dict:
-                                        word_dict[w.attr] = []
-                                    word_dict[w.attr].append(w)
-                            
-                            # Beginning of a new word    
-                            word_events = [event]
-                            word_event_jndices = [j]
-                            word_event_kndices = [k]
-                elif event.type == MetaType.Lyric:
-                    word_events.append(event)
-                    word_event_jndices.append(j)
-                    # Lyrics are interpreted differently
-                    # A standalone event with data = 0x0D ('\r') denotes a new line
-                    # Spaces are at the end of the word rather than the beginning of the next one
-                    # Words can still be split over multiple events, it seems like each event can only have one word in it
-                    
-                    if text[-1] == ' ' or event.data == b'\r':
-                        w = Word(MetaType.Lyric, word_events, i, word_event_jndices, [0])
-                        if event.data == b'\r':
-                            w.is_last_in_line = True
-                            
-                        words.append(w)
-                        if w.attr not in word_dict:
-                            word_dict[w.attr] = []
-                        word_dict[w.attr].append(w)
-
-                        # reset for the next word
-                        word_events = []
-                        word_event_jndices = []
-
-        # Get the last word left over (only necessary for text-type meta events)
-        if len(word_events) > 0:
-            w = Word(MetaType.Text, word_events, i, word_event_jndices, word_event_kndices)
+        meta_events = ((j, event) for j, event in enumerate(track) if isinstance(event, Events.MetaEvent))
+        for w in _track_words(i, meta_events):
             words.append(w)
-            if w.word.lower() not in word_dict:
+            if w.attr not in word_dict:
                 word_dict[w.attr] = []
             word_dict[w.attr].append(w)
 
+    count_syllables(words)
     return word_dict, words
 
+def _track_words(i, meta_events):
+    # Turn one track's meta events, as (index in track, event) pairs, into Words.
+    # Syllables aren't counted here, see count_syllables
+    # every event is decoded and split once here, and the pieces are handed to the Words
+    word_events = []
+    word_event_jndices = []
+    word_event_kndices = []
+    word_texts = []
+    for j, event in meta_events:
+        if event.type not in (MetaType.Text, MetaType.Lyric):
+            # Ignore all events that don't contain text
+            continue
+
+        text = event.data.decode('utf-8')
+        if len(text) == 0:
+            continue
+            
+        if event.type == MetaType.Text:
+            # Metadata, ignore
+            if text[0] == KarTag.TagIdentifier:
+                continue
+            else:
+                # Each syllable gets its own event, may need to combine multiple events into 1 word
+                # But also a single event might contain multiple words
+
+                # In this case, the event contains multiple words
+                words_in_event = []
+                words_in_event = text.split(' ')
+                words_in_event = [words_in_event[0]] + [' ' + part for part in words_in_event[1:]]
+                if text[0] == ' ':
+                    words_in_event = words_in_event[1:]
+
+                for k, _text in enumerate(words_in_event):
+                    # This should always be the case except when processing the first event
+                    if len(word_events) > 0:
+                        if _text[0] not in (' ', '\\', '/'):
+                            # Continuation of word from a previous event
+                            word_events.append(event)
+                            word_event_jndices.append(j)
+                            word_event_kndices.append(k)
+                            word_texts.append(sys.intern(_text))
+                            continue
+                        else:
+                            # New word, process previous one
+                            yield Word(MetaType.Text, word_events, i, word_event_jndices, word_event_kndices, count_syllables=False, texts=word_texts)
+                    
+                    # Beginning of a new word    
+                    word_events = [event]
+                    word_event_jndices = [j]
+                    word_event_kndices = [k]
+                    word_texts = [sys.intern(_text)]
+        elif event.type == MetaType.Lyric:
+            word_events.append(event)
+            word_event_jndices.append(j)
+            word_texts.append(sys.intern(text[1:] if text[0] == ' ' else text))
+            # Lyrics are interpreted differently
+            # A standalone event with data = 0x0D ('\r') denotes a new line
+            # Spaces are at the end of the word rather than the beginning of the next one
+            # Words can still be split over multiple events, it seems like each event can only have one word in it
+            
+            if text[-1] == ' ' or event.data == b'\r':
+                w = Word(MetaType.Lyric, word_events, i, word_event_jndices, [0], count_syllables=False, texts=word_texts)
+                if event.data == b'\r':
+                    w.is_last_in_line = True
+                yield w
+
+                # reset for the next word
+                word_events = []
+                word_event_jndices = []
+                word_texts = []
+
+    # Get the last word left over (only necessary for text-type meta events)
+    if len(word_events) > 0:
+        yield Word(MetaType.Text, word_events, i, word_event_jndices, word_event_kndices, count_syllables=False, texts=word_texts)
+
+# Lyric-only reading, straight from the bytes of the file without MIDIFile.
+# Only the text and lyric meta events get decoded, everything else is skipped over by its length.
+
+# A text/lyric meta event. start/end are the offsets of the event (including its delta time) in the track chunk
+RawEvent = namedtuple("RawEvent", ["type", "data", "time", "delta", "start", "end"])
+
+def _read_varlen(buf, pos):
+    value = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7f)
+        if b < 0x80:
+            return value, pos
+
+def _write_varlen(value):
+    out = bytearray([value & 0x7f])
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7f))
+        value >>= 7
+    out.reverse()
+    return out
+
+@contextmanager
+def map_kar(filen):
+    # Memory-map a .kar read-only. Slicing the memoryview doesn't copy anything,
+    # so only the pages that actually get looked at are read in
+    with open(filen, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+def read_header(buf):
+    # (format, number of tracks, division) from the MThd chunk
+    if bytes(buf[0:4]) != b"MThd":
+        raise ValueError("not a midi file")
+    return (
+        int.from_bytes(buf[8:10], "big"),
+        int.from_bytes(buf[10:12], "big"),
+        int.from_bytes(buf[12:14], "big"),
+    )
+
+def iter_track_chunks(buf):
+    # yields (offset of the chunk data, length) for every MTrk chunk
+    pos = 0
+    while pos + 8 <= len(buf):
+        chunk_type = bytes(buf[pos:pos+4])
+        length = int.from_bytes(buf[pos+4:pos+8], "big")
+        if chunk_type == b"MTrk":
+            yield pos + 8, length
+        pos += 8 + length
+
+def iter_text_events(track):
+    # yields (index in track, RawEvent) for the text and lyric events in one track chunk.
+    # Indices count every event, so they line up with the ones from Track.parse()
+    pos = 0
+    time = 0
+    running_status = 0
+    j = 0
+    end = len(track)
+    while pos < end:
+        start = pos
+        delta, pos = _read_varlen(track, pos)
+        time += delta
+        status = track[pos]
+
+        if status == 0xff:
+            meta_type = track[pos+1]
+            length, pos = _read_varlen(track, pos+2)
+            if meta_type == MetaType.Text or meta_type == MetaType.Lyric:
+                yield j, RawEvent(meta_type, bytes(track[pos:pos+length]), time, delta, start, pos + length)
+            pos += length
+        elif status == 0xf0 or status == 0xf7:
+            length, pos = _read_varlen(track, pos+1)
+            pos += length
+        else:
+            if status & 0x80:
+                running_status = status
+                pos += 1
+            # program change and channel pressure have one data byte, everything else has two
+            pos += 1 if running_status & 0xf0 in (0xc0, 0xd0) else 2
+        j += 1
+
+def iter_lyric_words(buf):
+    # Generator over the Words of a whole .kar file (as bytes), without parsing any of the other events.
+    # n_syllables is left as None, run count_syllables over the words afterwards
+    for i, (offset, length) in enumerate(iter_track_chunks(buf)):
+        with memoryview(buf)[offset:offset+length] as track:
+            yield from _track_words(i, iter_text_events(track))
+
+def read_lyrics(filen, use_mmap=True):
+    # lyric-only equivalent of parsing the file and calling generate_word_dict
+    word_dict = {}
+    words = []
+
+    if use_mmap:
+        with map_kar(filen) as buf:
+            words = list(iter_lyric_words(buf))
+    else:
+        with open(filen, "rb") as f:
+            words = list(iter_lyric_words(f.read()))
+
+    for w in words:
+        if w.attr not in word_dict:
+            word_dict[w.attr] = []
+        word_dict[w.attr].append(w)
+
+    count_syllables(words)
+    return word_dict, words
+
+def kar_tags(midi):
+    # Collect the @ tags from the text events, e.g. {"T": ["Title", "Artist", "Sequencer"], "K": [...]}
+    events = []
+    for track in midi:
+        if len(track.events) == 0:
+            track.parse()
+        events.extend(event for event in track if isinstance(event, Events.MetaEvent))
+    return _collect_tags(events)
+
+def read_kar_tags(buf):
+    # same as kar_tags, straight from the bytes of the file
+    events = []
+    for offset, length in iter_track_chunks(buf):
+        with memoryview(buf)[offset:offset+length] as track:
+            events.extend(event for _, event in iter_text_events(track))
+    return _collect_tags(events)
+
+def _collect_tags(events):
+    tags = {}
+    for event in events:
+        if event.type != MetaType.Text:
+            continue
+        text = event.data.decode('utf-8', errors='replace')
+        if len(text) < 2 or text[0] != KarTag.TagIdentifier:
+            continue
+        tags.setdefault(text[1], []).append(text[2:].strip())
+    return tags
+
+def count_syllables(words):
+    # Count syllables for a whole song in one batch (each distinct word is only hyphenated once).
+    # Fills in n_syllables on words that don't have it yet, returns the counts in the same order as words
+    pending = [w for w in words if w.n_syllables is None]
+    for w, n in zip(pending, syllable_counts([w.word for w in pending])):
+        w.n_syllables = n
+    return [w.n_syllables for w in words]
+
+def tag_parts_of_speech(words):
+    # Fill in pos on words that don't have it yet, as a list of (part of speech, inflection) it could be
+    # (see pos.lookup). Each distinct word is only looked up once per song
+    tags = {}
+    for w in words:
+        if w.pos is None:
+            if w.word not in tags:
+                tags[w.word] = pos_lookup(w.word) if w.word else []
+            w.pos = tags[w.word]
+    return [w.pos for w in words]
+
 def format_words(words):
     lyrics = []
     line = []
@@ -234,24 +546,90 @@ def format_words(words):
 
     return lyrics
 
-def by_id(id):
-    # TODO: pass filen instead of song id
-    for song in DB["songs"]:
-        if song["id"] == id:
-            filen = DB["config"]["karaoke_dir"] + song["filen"]
+# Parsed songs, keyed by filen (plus what kind of entry it is). Shared with compiled.load_cached.
+# Entries are dicts with the file's (mtime, size) as "key", and are only reused while that matches
+def _song_cache_limit():
+    return DB["config"].get("parse_cache_mb", 64) * 1024 * 1024
 
-            midi = MIDIFile(filen)
-            midi.parse()
-            word_dict, words = generate_word_dict(midi)
+SONG_CACHE = LRUCache(max_bytes=_song_cache_limit)
 
-            return {
-                "words": format_words(words),
-                "word_dict": word_dict,
-            }
-        else:
-            continue
+# Words + events take up way more room than the raw file, this is a rough guess at how much
+PARSED_SIZE_FACTOR = 50
+
+# Raw entries only hold the file bytes and the lyric words
+RAW_SIZE_FACTOR = 10
+
+def load_song(filen, raw=False):
+    # raw=True skips the midi parse and keeps the file bytes instead, for export_patched
+    stat = os.stat(filen)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cache_key = (filen, "raw") if raw else filen
+
+    entry = SONG_CACHE.get(cache_key, fresh=lambda entry: entry["key"] == key)
+    if entry is not None:
+        return entry
+
+    # parse outside the lock so one big file doesn't hold up everyone else
+    if raw:
+        entry = _load_raw(filen, key)
+    else:
+        midi = MIDIFile(filen)
+        midi.parse()
+        word_dict, words = generate_word_dict(midi)
+
+        entry = {
+            "key": key,
+            "midi": midi,
+            "words": words,
+            "word_dict": word_dict,
+            "size": stat.st_size * PARSED_SIZE_FACTOR,
+        }
+
+    return SONG_CACHE.put(cache_key, entry, entry["size"])
+
+def _load_raw(filen, key):
+    with open(filen, "rb") as f:
+        raw = f.read()
+
+    read_header(raw)
+    chunks = list(iter_track_chunks(raw))
+
+    # the events of these words are RawEvents, so they know where they sit in their track chunk
+    words = list(iter_lyric_words(raw))
+    word_dict = {}
+    for w in words:
+        if w.attr not in word_dict:
+            word_dict[w.attr] = []
+        word_dict[w.attr].append(w)
+
+    return {
+        "key": key,
+        "raw": raw,
+        "chunks": chunks,
+        "words": words,
+        "word_dict": word_dict,
+        "size": len(raw) * RAW_SIZE_FACTOR,
+    }
+
+def song_cache_stats():
+    return SONG_CACHE.info()
+
+def clear_song_cache():
+    SONG_CACHE.clear()
+
+def _copy_midi(midi):
+    # cached midi objects are shared between requests, so give exports their own event lists to mess with
+    out = copy.copy(midi)
+    out.tracks = []
+    for track in midi.tracks:
+        track_copy = copy.copy(track)
+        track_copy.events = list(track.events)
+        out.tracks.append(track_copy)
+    return out
 
 class WordReplacement:
+    __slots__ = ("word", "new_text")
+
     def __init__(self, word, new_text):
         self.word = word
         self.new_text = new_text
@@ -272,13 +650,8 @@ def replace_in_title(key, replaceWith, title):
             new_title.append(word)
     return new_title
 
-def construct_madlib_file(ofd, midi_filen, madlib):
-    midi = MIDIFile(midi_filen)
-    midi.parse()
-    word_dict, _ = generate_word_dict(midi)
-
+def _replacements(word_dict, madlib, out_title_words):
     replacements = []
-    out_title_words = ofd["title"].split(' ')
     for m in madlib:
         key = m["baseWordKey"]
         new_text = m["replaceWith"]
@@ -287,7 +660,30 @@ def construct_madlib_file(ofd, midi_filen, madlib):
         for word in words:
             replacements.append(WordReplacement(word, new_text))
             out_title_words = replace_in_title(key, new_text, out_title_words)
-    
+    return replacements, out_title_words
+
+def _out_filen(ofd, out_title_words):
+    # ofd = out_filen_data
+    ofd["title"] = "_".join(out_title_words)
+    return f"{ofd['title']}_sung_by_{ofd['singer']}_filled_by_{ofd['author']}__{ofd['id']}.kar"
+
+def construct_madlib_file(ofd, midi_filen, madlib):
+    # "patch" only re-encodes the tracks that have replaced words, "full" re-exports the parsed midi
+    export_mode = DB["config"].get("export_mode", "patch")
+    in_title_words = ofd["title"].split(' ')
+
+    if export_mode == "patch":
+        entry = load_song(midi_filen, raw=True)
+        replacements, out_title_words = _replacements(entry["word_dict"], madlib, in_title_words)
+
+        out_filen = _out_filen(ofd, out_title_words)
+        if export_patched(ofd["dir"] + out_filen, entry, replacements):
+            return out_filen
+
+    entry = load_song(midi_filen)
+    midi = _copy_midi(entry["midi"])
+    replacements, out_title_words = _replacements(entry["word_dict"], madlib, in_title_words)
+
     # sort replacements such that highest event_idx[0] is at the front
     replacements = sorted(replacements, reverse=True)
 
@@ -300,13 +696,9 @@ def construct_madlib_file(ofd, midi_filen, madlib):
     for i in range(len(in_words)):
         replace_one_word(midi, in_words[i], new_texts[i])
 
-
-    # ofd = out_filen_data
-    ofd["title"] = "_".join(out_title_words)
-    out_filen = f"{ofd['title']}_sung_by_{ofd['singer']}_filled_by_{ofd['author']}__{ofd['id']}.kar"
-
+    out_filen = _out_filen(ofd, out_title_words)
     midi.export(ofd["dir"] + out_filen)
-    
+    return out_filen
 
 # tide goes in, tide goes out. can't explain it
 # note: replace from the back to front so you don't mess up ev_indices
@@ -326,6 +718,17 @@ def replace_one_word(midi, in_word, new_text):
     id_f = in_word.event_idxs[-1]
     
     # 3. create new events for each syllable in new_word
+    new_events = []
+    for delta, buf in syllable_events(in_word, new_text, total_delta):
+        ev = Events.MetaEvent(delta, start_time, buf)
+        new_events.append(ev)
+        start_time += delta
+
+    # 4. the ol' switcheroo
+    track.events[id_0:id_f+1] = new_events
+
+def syllable_events(in_word, new_text, total_delta):
+    # (delta, meta event buffer) for each syllable of new_text, spread over the time the old word took
     syllables = hyphenate_word(new_text)
     N = len(syllables)
     deltas = [total_delta // N + (1 if n < total_delta % N else 0) for n in range(N)]
@@ -348,10 +751,61 @@ def replace_one_word(midi, in_word, new_text):
 
         buf.extend(len(s).to_bytes(1, "big")) # length will never be > 127
         buf.extend(s.encode("utf-8"))
-        
-        ev = Events.MetaEvent(deltas[i], start_time, buf)
-        new_events.append(ev)
-        start_time += deltas[i]
+        new_events.append((deltas[i], buf))
 
-    # 4. the ol' switcheroo
-    track.events[id_0:id_f+1] = new_events
\ No newline at end of file
+    return new_events
+
+def export_patched(out_filen, entry, replacements):
+    # Write the madlib straight from the original bytes (an entry from load_song(filen, raw=True)).
+    # Tracks without replacements are copied over as is, the others are stitched back together
+    # from the untouched byte ranges plus the new syllable events.
+    # Returns False without writing anything if it can't be done this way, then use the full export
+    by_track = {}
+    for replacement in replacements:
+        word = replacement.word
+        if any(a.end != b.start for a, b in zip(word.events, word.events[1:])):
+            # other events (notes, ...) between the syllables get cut out with the word, and a later
+            # event might need the status byte of one of them (running status)
+            return False
+        spans = by_track.setdefault(word.track_idx, {})
+        other = spans.get(word.events[0].start)
+        if other is not None and other.word is not word:
+            # two words in the same text event (" /baby love"), only the full export can redo the event
+            return False
+        # a later filling for the same word wins
+        spans[word.events[0].start] = replacement
+
+    raw = entry["raw"]
+    new_chunks = {}
+    for track_idx, spans in by_track.items():
+        offset, length = entry["chunks"][track_idx]
+        data = bytearray()
+        pos = 0
+        for start in sorted(spans):
+            replacement = spans[start]
+            if start < pos:
+                # the end of one word and the start of the next are in the same event
+                return False
+            data += raw[offset+pos:offset+start]
+
+            total_delta = 0
+            for ev in replacement.word.events:
+                total_delta += ev.delta
+            for delta, buf in syllable_events(replacement.word, replacement.new_text, total_delta):
+                data += _write_varlen(delta)
+                data += buf
+            pos = replacement.word.events[-1].end
+        data += raw[offset+pos:offset+length]
+        new_chunks[track_idx] = data
+
+    with open(out_filen, "wb") as out_file:
+        # MThd chunk
+        out_file.write(raw[:entry["chunks"][0][0] - 8] if entry["chunks"] else raw)
+        for i, (offset, length) in enumerate(entry["chunks"]):
+            data = new_chunks.get(i)
+            if data is None:
+                out_file.write(raw[offset-8:offset+length])
+            else:
+                out_file.write(b"MTrk" + len(data).to_bytes(4, "big"))
+                out_file.write(data)
+    return True
\ No newline at end of file
@@ -10,16 +10,36 @@
     >>> hyphenate_word("project")
     ['project']
 
+    hyphenate_words does the same for a list of words, and cache_info reports
+    how well the memo cache of recently hyphenated words is doing.
+
     Ned Batchelder, July 2007.
     This Python code is in the public domain.
 """
 
+import os
 import re
+import sys
+import json
+import mmap
+import array
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 
 __version__ = '1.0.20070709'
 
 class Hyphenator:
-    def __init__(self, patterns, exceptions=''):
+    def __init__(self, patterns, exceptions='', cache_size=20000):
+        # Lyrics repeat the same few words over and over, so remember the points
+        # for recently seen words (keyed by the lowercase word).
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_lock = threading.Lock()
+
         self.tree = {}
         for pattern in patterns.split():
             self._insert_pattern(pattern)
@@ -45,18 +65,14 @@ class Hyphenator:
             t = t[c]
         t[None] = points
 
-    def hyphenate_word(self, word):
-        """ Given a word, returns a list of pieces, broken at the possible
-            hyphenation points.
+    def _points(self, lower_word):
+        """ Compute the hyphenation points for a lowercase word.
         """
-        # Short words aren't hyphenated.
-        if len(word) <= 4:
-            return [word]
         # If the word is an exception, get the stored points.
-        if word.lower() in self.exceptions:
-            points = self.exceptions[word.lower()]
+        if lower_word in self.exceptions:
+            points = self.exceptions[lower_word]
         else:
-            work = '.' + word.lower() + '.'
+            work = '.' + lower_word + '.'
             points = [0] * (len(work)+1)
             for i in range(len(work)):
                 t = self.tree
@@ -66,11 +82,39 @@ class Hyphenator:
                         if None in t:
                             p = t[None]
                             for j in range(len(p)):
-                                points[i+j] = max(points[i+j], p[j])
+                                if p[j] > points[i+j]:
+                                    points[i+j] = p[j]
                     else:
                         break
             # No hyphens in the first two chars or the last two.
             points[1] = points[2] = points[-2] = points[-3] = 0
+        return tuple(points)
+
+    def _cached_points(self, lower_word):
+        with self.cache_lock:
+            points = self.cache.get(lower_word)
+            if points is not None:
+                self.cache.move_to_end(lower_word)
+                self.cache_hits += 1
+                return points
+            self.cache_misses += 1
+
+        points = self._points(lower_word)
+
+        with self.cache_lock:
+            self.cache[lower_word] = points
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return points
+
+    def hyphenate_word(self, word):
+        """ Given a word, returns a list of pieces, broken at the possible
+            hyphenation points.
+        """
+        # Short words aren't hyphenated.
+        if len(word) <= 4:
+            return [word]
+        points = self._cached_points(word.lower())
 
         # Examine the points to build the pieces list.
         pieces = ['']
@@ -80,6 +124,207 @@ class Hyphenator:
                 pieces.append('')
         return pieces
 
+    def syllable_counts(self, words):
+        """ Returns how many pieces hyphenate_word would split each word into,
+            without building the pieces.  Repeated words are only looked up once.
+        """
+        counts = {}
+        out = []
+        for word in words:
+            lower_word = word.lower()
+            n = counts.get(lower_word)
+            if n is None:
+                if len(word) <= 4:
+                    n = 1
+                else:
+                    # one piece, plus one more for every odd point inside the word
+                    points = self._cached_points(lower_word)
+                    n = 1 + sum(p & 1 for p in points[2:len(word)+2])
+                counts[lower_word] = n
+            out.append(n)
+        return out
+
+    def hyphenate_words(self, words):
+        """ Hyphenate a list of words in one go, returns a list of piece lists
+            in the same order.  Repeated words are only looked up once.
+        """
+        seen = {}
+        out = []
+        for word in words:
+            if word not in seen:
+                seen[word] = self.hyphenate_word(word)
+            # callers are allowed to modify the lists they get back
+            out.append(list(seen[word]))
+        return out
+
+    def cache_info(self):
+        """ Returns the memo cache statistics as a dict.
+        """
+        with self.cache_lock:
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "size": len(self.cache),
+                "max_size": self.cache_size,
+            }
+
+    def clear_cache(self):
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+class PackedHyphenator(Hyphenator):
+    """ The same algorithm as Hyphenator, but the pattern trie is packed into
+        flat arrays instead of nested dicts, so it can be saved to a file and
+        memory-mapped back in without rebuilding anything.
+
+        Node n's outgoing edges are edge_chars/edge_nodes[node_first[n]:node_first[n+1]],
+        sorted by character, and its points (if a pattern ends there) are
+        points[point_first[n]:point_first[n+1]].
+    """
+    MAGIC = b'HYPT'
+    VERSION = 1
+
+    def __init__(self, node_first, edge_chars, edge_nodes, point_first, points, exceptions, cache_size=20000):
+        Hyphenator.__init__(self, '', cache_size=cache_size)
+        self.tree = None
+        self.exceptions = exceptions
+        self.node_first = node_first
+        self.edge_chars = edge_chars
+        self.edge_nodes = edge_nodes
+        self.point_first = point_first
+        self.points = points
+
+    @classmethod
+    def from_hyphenator(cls, hyphenator):
+        """ Pack the dict tree of a regular Hyphenator.
+        """
+        node_first = array.array('I', [0])
+        edge_chars = array.array('B')
+        edge_nodes = array.array('I')
+        point_first = array.array('I', [0])
+        points = array.array('B')
+
+        # Breadth first, so every node's edges end up next to each other.
+        queue = [hyphenator.tree]
+        n_nodes = 1
+        for t in queue:
+            for c in sorted(k for k in t if k is not None):
+                edge_chars.append(ord(c))
+                edge_nodes.append(n_nodes)
+                queue.append(t[c])
+                n_nodes += 1
+            node_first.append(len(edge_chars))
+            points.extend(t.get(None, []))
+            point_first.append(len(points))
+
+        return cls(node_first, edge_chars, edge_nodes, point_first, points, dict(hyphenator.exceptions), hyphenator.cache_size)
+
+    def _points(self, lower_word):
+        if lower_word in self.exceptions:
+            return tuple(self.exceptions[lower_word])
+
+        node_first = self.node_first
+        edge_chars = self.edge_chars
+        edge_nodes = self.edge_nodes
+        point_first = self.point_first
+        all_points = self.points
+
+        work = [ord(c) for c in '.' + lower_word + '.']
+        points = [0] * (len(work)+1)
+        for i in range(len(work)):
+            n = 0
+            for c in work[i:]:
+                hi = node_first[n+1]
+                e = bisect_left(edge_chars, c, node_first[n], hi)
+                if e == hi or edge_chars[e] != c:
+                    break
+                n = edge_nodes[e]
+                p0 = point_first[n]
+                p1 = point_first[n+1]
+                if p0 != p1:
+                    # points[i:] = max(points[i:], this node's points)
+                    k = i - p0
+                    for j in range(p0, p1):
+                        if all_points[j] > points[k+j]:
+                            points[k+j] = all_points[j]
+        # No hyphens in the first two chars or the last two.
+        points[1] = points[2] = points[-2] = points[-3] = 0
+        return tuple(points)
+
+    def save(self, path, source_hash=''):
+        """ Write the packed trie to path.  source_hash is stored so stale
+            files can be spotted by load.
+        """
+        exceptions = json.dumps(self.exceptions).encode('utf-8')
+        sections = [self.node_first, self.edge_chars, self.edge_nodes, self.point_first, self.points]
+        header = {
+            "version": self.VERSION,
+            "byteorder": sys.byteorder,
+            "source_hash": source_hash,
+            "lengths": [len(a) for a in sections],
+            "exceptions": len(exceptions),
+        }
+        header = json.dumps(header).encode('utf-8')
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(len(header).to_bytes(4, 'little'))
+            f.write(header)
+            f.write(exceptions)
+            for a in sections:
+                # keep every array 4-byte aligned so it can be cast in place
+                f.write(b'\0' * (-f.tell() % 4))
+                f.write(a.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_hash=None, cache_size=20000):
+        """ Memory-map a file written by save.  Returns None if the file is
+            missing, from another machine, corrupt or truncated, or doesn't
+            match source_hash.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if data[:4] != cls.MAGIC:
+            return None
+        try:
+            header_len = int.from_bytes(data[4:8], 'little')
+            header = json.loads(data[8:8+header_len])
+            if header["version"] != cls.VERSION or header["byteorder"] != sys.byteorder:
+                return None
+            if source_hash is not None and header["source_hash"] != source_hash:
+                return None
+
+            offset = 8 + header_len
+            exceptions = json.loads(data[offset:offset+header["exceptions"]])
+            offset += header["exceptions"]
+
+            view = memoryview(data)
+            sections = []
+            for length, typecode in zip(header["lengths"], ('I', 'B', 'I', 'I', 'B')):
+                offset += -offset % 4
+                size = length * array.array(typecode).itemsize
+                if offset + size > len(data):
+                    # truncated
+                    return None
+                sections.append(view[offset:offset+size].cast(typecode))
+                offset += size
+        except (ValueError, KeyError, TypeError):
+            # corrupt, build the dict tree instead
+            return None
+
+        return cls(*sections, exceptions, cache_size)
+
+def patterns_hash(patterns, exceptions):
+    return hashlib.sha1((patterns + '\0' + exceptions).encode('utf-8')).hexdigest()
+
 patterns = (
 # Knuth and Liang's original hyphenation patterns from classic TeX.
 # In the public domain.
@@ -507,8 +752,48 @@ presents project projects reci-procity re-cog-ni-zance ref-or-ma-tion
 ret-ri-bu-tion ta-ble
 """
 
-hyphenator = Hyphenator(patterns, exceptions)
-hyphenate_word = hyphenator.hyphenate_word
+# A prebuilt packed trie, written with `python hyphenate.py`.  Loading it is a
+# lot quicker than building the dict tree from the patterns above (~100ms, once
+# per process), but hyphenating with it is ~2.5x slower (see
+# benchmarks/bench_hyphenate.py), so it's only used when HYPHENATE_PACKED=1 is
+# set, e.g. for lots of short-lived processes that each hyphenate a few words.
+PACKED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res', 'hyphenate.trie')
+USE_PACKED = os.environ.get('HYPHENATE_PACKED', '') == '1'
+
+# Nothing is built until the first word gets hyphenated, so importing this
+# module (and everything that imports it) stays cheap.
+_hyphenator = None
+_hyphenator_lock = threading.Lock()
+
+def get_hyphenator():
+    """ Returns the shared Hyphenator, building it (or loading the packed trie,
+        see USE_PACKED) on first use.
+    """
+    global _hyphenator
+    if _hyphenator is None:
+        with _hyphenator_lock:
+            if _hyphenator is None:
+                hyphenator = None
+                if USE_PACKED:
+                    hyphenator = PackedHyphenator.load(PACKED_PATH, patterns_hash(patterns, exceptions))
+                if hyphenator is None:
+                    hyphenator = Hyphenator(patterns, exceptions)
+                _hyphenator = hyphenator
+    return _hyphenator
+
+def hyphenate_word(word):
+    return get_hyphenator().hyphenate_word(word)
+
+def hyphenate_words(words):
+    return get_hyphenator().hyphenate_words(words)
+
+def syllable_counts(words):
+    return get_hyphenator().syllable_counts(words)
+
+def cache_info():
+    return get_hyphenator().cache_info()
 
-del patterns
-del exceptions
\ No newline at end of file
+if __name__ == '__main__':
+    packed = PackedHyphenator.from_hyphenator(Hyphenator(patterns, exceptions))
+    packed.save(PACKED_PATH, patterns_hash(patterns, exceptions))
+    print(f"wrote {PACKED_PATH}")
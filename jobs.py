@@ -0,0 +1,116 @@
+import json
+import time
+import hashlib
+import threading
+import traceback
+from uuid import uuid4 as uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import extract
+
+# Background karaoke file exports. Threads rather than processes so the workers share
+# extract's song cache, the request that submits a job returns right away either way.
+JOBS = {
+    "executor": None,
+    "max_pending": 32,
+    "by_id": {},    # job id -> job
+    "pending": {},  # (madlib id, hash of everything that goes into the file) -> job id, while queued or running
+    "finished": [], # job ids in the order they finished, old ones get dropped
+    "on_done": [],  # callbacks, called with the job after a successful export
+}
+JOBS_LOCK = threading.Lock()
+
+# finished jobs stick around this long so the status can still be polled
+KEEP_FINISHED = 500
+
+class QueueFull(Exception):
+    pass
+
+def init(CFG):
+    JOBS["executor"] = ThreadPoolExecutor(
+        max_workers=CFG.get("export_workers", 2),
+        thread_name_prefix="export",
+    )
+    JOBS["max_pending"] = CFG.get("export_queue_depth", 32)
+
+def _job_key(ofd, midi_filen, fillings):
+    h = hashlib.sha1(json.dumps([ofd, midi_filen, fillings], sort_keys=True).encode("utf-8"))
+    return (ofd["id"], h.hexdigest())
+
+def _public(job):
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+def submit(ofd, midi_filen, fillings):
+    # Queue an export, returns the job. An identical export that's still queued or running
+    # is returned instead of starting another one. Raises QueueFull when too many are waiting
+    key = _job_key(ofd, midi_filen, fillings)
+
+    with JOBS_LOCK:
+        job_id = JOBS["pending"].get(key)
+        if job_id is not None:
+            return _public(JOBS["by_id"][job_id])
+
+        if len(JOBS["pending"]) >= JOBS["max_pending"]:
+            raise QueueFull(f"{len(JOBS['pending'])} exports already waiting")
+
+        job = {
+            "id": uuid().hex,
+            "madlib": ofd["id"],
+            "state": "queued",
+            "filen": None,
+            "error": None,
+            "submitted": time.time(),
+            "started": None,
+            "finished": None,
+            "_key": key,
+        }
+        JOBS["by_id"][job["id"]] = job
+        JOBS["pending"][key] = job["id"]
+
+    JOBS["executor"].submit(_run, job, dict(ofd), midi_filen, fillings)
+    return _public(job)
+
+def _run(job, ofd, midi_filen, fillings):
+    with JOBS_LOCK:
+        job["state"] = "running"
+        job["started"] = time.time()
+
+    try:
+        filen = extract.construct_madlib_file(ofd, midi_filen, fillings)
+        state, error = "done", None
+    except Exception as e:
+        traceback.print_exc()
+        filen, state, error = None, "failed", str(e)
+
+    with JOBS_LOCK:
+        job["state"] = state
+        job["filen"] = filen
+        job["error"] = error
+        job["finished"] = time.time()
+        JOBS["pending"].pop(job["_key"], None)
+
+        JOBS["finished"].append(job["id"])
+        while len(JOBS["finished"]) > KEEP_FINISHED:
+            JOBS["by_id"].pop(JOBS["finished"].pop(0), None)
+
+    if state == "done":
+        for callback in JOBS["on_done"]:
+            try:
+                callback(_public(job))
+            except Exception:
+                traceback.print_exc()
+
+def status(job_id):
+    with JOBS_LOCK:
+        job = JOBS["by_id"].get(job_id)
+        if job is None:
+            return None
+        out = _public(job)
+
+        if job["state"] == "queued":
+            # how many queued jobs were submitted before this one
+            out["position"] = sum(
+                1 for other_id in JOBS["pending"].values()
+                if JOBS["by_id"][other_id]["state"] == "queued" and JOBS["by_id"][other_id]["submitted"] < job["submitted"]
+            )
+    return out
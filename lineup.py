@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import threading
+from uuid import uuid4 as uuid
+
+# The night's singer queue. Lives in memory, every change is appended to a journal
+# (one json op per line) that gets replayed on startup, so a restart keeps the lineup.
+LINEUP = {
+    "queue": [],      # entries waiting to sing, in order
+    "current": None,  # entry that's singing right now
+    "version": 0,     # bumped on every change, the host screen long-polls on it
+    "journal": None,
+    "n_ops": 0,       # ops in the journal since it was last compacted
+}
+# wait()ers get woken up by every change
+LINEUP_COND = threading.Condition()
+
+# rewrite the journal as a single snapshot once it has this many ops in it
+COMPACT_AFTER = 500
+# longest a long-poll request is held open
+MAX_WAIT = 30
+
+def init(CFG):
+    with LINEUP_COND:
+        LINEUP["journal"] = CFG.get("lineup_journal", "res/lineup.jsonl")
+        LINEUP["queue"] = []
+        LINEUP["current"] = None
+        LINEUP["version"] = 0
+        _replay()
+        # start every run from a compact journal, also drops a half written last line if there was a crash
+        _compact()
+
+def _replay():
+    try:
+        with open(LINEUP["journal"], "r") as journal_file:
+            for line in journal_file:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the file
+                    break
+                _apply(op)
+    except FileNotFoundError:
+        pass
+
+def _apply(op):
+    # only place the lineup changes, used both live and when replaying the journal
+    queue = LINEUP["queue"]
+    kind = op["op"]
+    if kind == "snapshot":
+        LINEUP["queue"] = op["queue"]
+        LINEUP["current"] = op["current"]
+    elif kind == "enqueue":
+        queue.append(op["entry"])
+    elif kind == "update":
+        for entry in queue:
+            if entry["id"] == op["entry"]["id"]:
+                entry.update(op["entry"])
+    elif kind == "move":
+        idx = _index(op["id"])
+        if idx is not None:
+            queue.insert(min(max(op["position"], 0), len(queue) - 1), queue.pop(idx))
+    elif kind == "skip":
+        idx = _index(op["id"])
+        if idx is not None:
+            queue.pop(idx)
+    elif kind == "pop":
+        LINEUP["current"] = queue.pop(0) if len(queue) > 0 else None
+    LINEUP["version"] = op.get("version", LINEUP["version"] + 1)
+
+def _index(entry_id):
+    for i, entry in enumerate(LINEUP["queue"]):
+        if entry["id"] == entry_id:
+            return i
+    return None
+
+def _record(op):
+    # caller holds LINEUP_COND
+    op["version"] = LINEUP["version"] + 1
+    _apply(op)
+
+    with open(LINEUP["journal"], "a") as journal_file:
+        journal_file.write(json.dumps(op, separators=(',', ':')) + "\n")
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    LINEUP["n_ops"] += 1
+    if LINEUP["n_ops"] >= COMPACT_AFTER:
+        _compact()
+
+    LINEUP_COND.notify_all()
+
+def _compact():
+    snapshot = {
+        "op": "snapshot",
+        "queue": LINEUP["queue"],
+        "current": LINEUP["current"],
+        "version": LINEUP["version"],
+    }
+    tmp_filen = LINEUP["journal"] + ".tmp"
+    with open(tmp_filen, "w") as journal_file:
+        journal_file.write(json.dumps(snapshot, separators=(',', ':')) + "\n")
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    os.replace(tmp_filen, LINEUP["journal"])
+    LINEUP["n_ops"] = 0
+
+def _state():
+    return {
+        "version": LINEUP["version"],
+        "queue": [dict(entry) for entry in LINEUP["queue"]],
+        "current": dict(LINEUP["current"]) if LINEUP["current"] is not None else None,
+    }
+
+def get_lineup():
+    with LINEUP_COND:
+        return _state()
+
+def wait(since, timeout=MAX_WAIT):
+    # blocks until the lineup is newer than version `since` (or the timeout runs out), then returns it
+    with LINEUP_COND:
+        LINEUP_COND.wait_for(lambda: LINEUP["version"] != since, timeout=min(timeout, MAX_WAIT))
+        return _state()
+
+def enqueue(madlib_id, singer_name="", song_name="", filen=None):
+    # a madlib that's already waiting keeps its spot, it just gets the new file
+    with LINEUP_COND:
+        for entry in LINEUP["queue"]:
+            if entry["madlib"] == madlib_id:
+                _record({"op": "update", "entry": {
+                    "id": entry["id"], "singer_name": singer_name, "song_name": song_name, "filen": filen,
+                }})
+                return dict(entry)
+
+        entry = {
+            "id": uuid().hex,
+            "madlib": madlib_id,
+            "singer_name": singer_name,
+            "song_name": song_name,
+            "filen": filen,
+            "added": time.time(),
+        }
+        _record({"op": "enqueue", "entry": entry})
+        return dict(entry)
+
+def move(entry_id, position):
+    with LINEUP_COND:
+        if _index(entry_id) is None:
+            return False
+        _record({"op": "move", "id": entry_id, "position": position})
+        return True
+
+def skip(entry_id):
+    with LINEUP_COND:
+        if _index(entry_id) is None:
+            return False
+        _record({"op": "skip", "id": entry_id})
+        return True
+
+def pop():
+    # next singer up, returns their entry (None once the queue is empty)
+    with LINEUP_COND:
+        _record({"op": "pop"})
+        return dict(LINEUP["current"]) if LINEUP["current"] is not None else None
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    # Thread safe least-recently-used cache, bounded by number of entries and/or total size.
+    # max_bytes can be a function so it can follow the config. Sizes are whatever put() is told,
+    # usually a rough guess. The newest entry is always kept, even if it's over the limit by itself
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+    def get(self, key, fresh=None):
+        # the value for key, None if there isn't one or fresh(value) says it's out of date
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (fresh is None or fresh(entry[0])):
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, value, size=0):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.stats["bytes"] -= old[1]
+            self.entries[key] = (value, size)
+            self.stats["bytes"] += size
+
+            max_bytes = self.max_bytes() if callable(self.max_bytes) else self.max_bytes
+            while len(self.entries) > 1 and (
+                (self.max_entries is not None and len(self.entries) > self.max_entries)
+                or (max_bytes is not None and self.stats["bytes"] > max_bytes)
+            ):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.stats["bytes"] -= evicted_size
+                self.stats["evictions"] += 1
+        return value
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.stats["bytes"] = 0
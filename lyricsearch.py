@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+
+import db
+import compiled
+import extract
+from extract import attr_code
+
+# Which songs have which words in them: attr -> {song id: [positions of the word in the song]}.
+# Saved to res/lyric_index.json and brought up to date song by song, only songs whose file
+# changed (or that are new) get read again. That happens on startup, and again (in the background)
+# when a search comes in and the last check is more than RECHECK_AFTER seconds old.
+LYRICS = {
+    "filen": None,
+    "karaoke_dir": None,
+    "checked": 0,        # time.monotonic() of the last update_index
+    "updating": False,
+    "songs": {},     # song id -> {"filen", "mtime_ns", "size", "n_words"} of what's indexed
+    "postings": {},  # attr -> {song id: [word positions]}
+}
+LYRICS_LOCK = threading.Lock()
+
+LYRIC_INDEX_VERSION = 1
+RECHECK_AFTER = 60
+
+def init(CFG, songs, background=True):
+    # load what's on disk right away, then catch up on changed songs (in a thread unless background=False)
+    LYRICS["filen"] = CFG.get("lyric_index", "res/lyric_index.json")
+    LYRICS["karaoke_dir"] = CFG["karaoke_dir"]
+    load_index()
+    if background:
+        _update_in_background(songs)
+    else:
+        update_index(CFG["karaoke_dir"], songs)
+
+def _update_in_background(songs):
+    with LYRICS_LOCK:
+        if LYRICS["updating"]:
+            return
+        LYRICS["updating"] = True
+    thread = threading.Thread(target=update_index, args=(LYRICS["karaoke_dir"], songs), daemon=True)
+    thread.start()
+
+def _maybe_recheck():
+    # pick up songs added (or changed) while the server is running
+    if LYRICS["karaoke_dir"] is not None and time.monotonic() - LYRICS["checked"] > RECHECK_AFTER:
+        _update_in_background(db.get_all_songs())
+
+def load_index():
+    try:
+        with open(LYRICS["filen"], "r") as index_file:
+            saved = json.load(index_file)
+    except (FileNotFoundError, ValueError):
+        return
+    if saved.get("version") != LYRIC_INDEX_VERSION:
+        return
+
+    with LYRICS_LOCK:
+        LYRICS["songs"] = saved["songs"]
+        LYRICS["postings"] = saved["postings"]
+
+def save_index():
+    with LYRICS_LOCK:
+        saved = json.dumps({
+            "version": LYRIC_INDEX_VERSION,
+            "songs": LYRICS["songs"],
+            "postings": LYRICS["postings"],
+        }, separators=(',', ':'))
+
+    tmp_filen = LYRICS["filen"] + ".tmp"
+    with open(tmp_filen, "w") as index_file:
+        index_file.write(saved)
+    os.replace(tmp_filen, LYRICS["filen"])
+
+def _remove_song(song_id):
+    # call with LYRICS_LOCK held
+    LYRICS["songs"].pop(song_id, None)
+    for attr in [attr for attr, songs in LYRICS["postings"].items() if song_id in songs]:
+        del LYRICS["postings"][attr][song_id]
+        if len(LYRICS["postings"][attr]) == 0:
+            del LYRICS["postings"][attr]
+
+def _song_postings(filen):
+    # only the attrs are needed, so no counting syllables or anything else the full compile does
+    words = compiled.load_compiled(filen)
+    if words is None:
+        with extract.map_kar(filen) as buf:
+            words = list(extract.iter_lyric_words(buf))
+
+    postings = {}
+    for i, w in enumerate(words):
+        postings.setdefault(w.attr, []).append(i)
+    return postings, len(words)
+
+def update_index(karaoke_dir, songs):
+    # re-index songs whose file changed since they were indexed, drop songs that are gone.
+    # Returns (songs (re)indexed, songs removed)
+    try:
+        return _update_index(karaoke_dir, songs)
+    finally:
+        with LYRICS_LOCK:
+            LYRICS["checked"] = time.monotonic()
+            LYRICS["updating"] = False
+
+def _update_index(karaoke_dir, songs):
+    start = time.perf_counter()
+    with LYRICS_LOCK:
+        indexed = dict(LYRICS["songs"])
+
+    n_indexed = 0
+    wanted = set()
+    for song in songs:
+        if "hidden" in song:
+            continue
+        song_id = str(song["id"])
+        wanted.add(song_id)
+        filen = karaoke_dir + song["filen"]
+        try:
+            stat = os.stat(filen)
+            info = indexed.get(song_id)
+            if info is not None and info["filen"] == song["filen"] and info["mtime_ns"] == stat.st_mtime_ns and info["size"] == stat.st_size:
+                continue
+            postings, n_words = _song_postings(filen)
+        except Exception as e:
+            print(f"lyric index: skipping {song['filen']} ({type(e).__name__}: {e})")
+            continue
+
+        with LYRICS_LOCK:
+            if song_id in LYRICS["songs"]:
+                _remove_song(song_id)
+            for attr, positions in postings.items():
+                LYRICS["postings"].setdefault(attr, {})[song_id] = positions
+            LYRICS["songs"][song_id] = {
+                "filen": song["filen"],
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "n_words": n_words,
+            }
+        n_indexed += 1
+
+    with LYRICS_LOCK:
+        gone = [song_id for song_id in LYRICS["songs"] if song_id not in wanted]
+        for song_id in gone:
+            _remove_song(song_id)
+
+    if n_indexed > 0 or len(gone) > 0:
+        save_index()
+        print(f"lyric index: {n_indexed} songs indexed, {len(gone)} removed in {time.perf_counter() - start:.2f}s")
+    return n_indexed, len(gone)
+
+def query(text, min_count=1, page=1, per_page=50):
+    # songs that have every word of text in them at least min_count times, most occurrences first.
+    # Returns ([{"song": id, "counts": {attr: n}, "positions": {attr: [...]}}, ...], total)
+    _maybe_recheck()
+    attrs = list(dict.fromkeys(attr_code(word) for word in text.split() if word))
+    if len(attrs) == 0:
+        return [], 0
+
+    with LYRICS_LOCK:
+        found = None
+        for attr in attrs:
+            songs = {song_id for song_id, positions in LYRICS["postings"].get(attr, {}).items() if len(positions) >= min_count}
+            found = songs if found is None else found & songs
+            if len(found) == 0:
+                return [], 0
+
+        results = []
+        for song_id in found:
+            positions = {attr: LYRICS["postings"][attr][song_id] for attr in attrs}
+            results.append({
+                "song": song_id,
+                "counts": {attr: len(p) for attr, p in positions.items()},
+                "positions": positions,
+            })
+
+    results.sort(key=lambda result: (-sum(result["counts"].values()), result["song"]))
+    start = (max(page, 1) - 1) * per_page
+    return results[start:start + per_page], len(results)
+
+if __name__ == "__main__":
+    with open("res/config.json", "rb") as cfg_file:
+        CFG = json.load(cfg_file)
+    with open(CFG["song_index"], "rb") as json_file:
+        songs = json.load(json_file)
+    init(CFG, songs, background=False)
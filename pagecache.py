@@ -0,0 +1,86 @@
+import gzip
+import json
+import time
+import hashlib
+
+from flask import make_response, request
+
+from lru import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Rendered html, keyed by whatever the page was rendered from (catalogue version, song file, template, ...).
+# Nothing is ever invalidated, a change just makes a new key and the old entry falls off the end.
+PAGE_CACHE_ENTRIES = 256
+PAGE_CACHE = LRUCache(max_entries=PAGE_CACHE_ENTRIES)
+
+# some of the versions in the keys are counters that start over on a restart, so etags from a
+# previous run must never match
+BOOT = str(time.time_ns())
+
+def _etag(key):
+    return hashlib.sha1(repr((BOOT, key)).encode("utf-8")).hexdigest()
+
+def get_or_render(key, render):
+    # (html, etag, time it was rendered) for key, calls render() if it's not cached
+    entry = PAGE_CACHE.get(key)
+    if entry is not None:
+        return entry
+
+    # render outside the lock, two requests for the same new page might both render it but that's fine
+    entry = (render(), _etag(key), time.time())
+    return PAGE_CACHE.put(key, entry, len(entry[0]))
+
+def cached_page(key, render, mimetype="text/html", headers=None):
+    # response for the page at key, a 304 if the browser already has it
+    etag = _etag(key)
+    if request.if_none_match.contains(etag):
+        # don't even need the html
+        response = make_response("", 304)
+        response.headers.extend(headers or {})
+        response.set_etag(etag)
+        return response
+
+    html, etag, rendered = get_or_render(key, render)
+    response = make_response(html)
+    response.mimetype = mimetype
+    response.headers.extend(headers or {})
+    response.set_etag(etag)
+    response.last_modified = rendered
+    # always check back with us, but a 304 is basically free
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def cached_json(key, build):
+    # like cached_page for build()'s result as json, compressed (once, then cached) if the browser takes it
+    encoding = _accepted_encoding()
+
+    def render():
+        body = json.dumps(build(), separators=(',', ':')).encode("utf-8")
+        if encoding == "br":
+            return brotli.compress(body)
+        if encoding == "gzip":
+            return gzip.compress(body, compresslevel=6)
+        return body
+
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return cached_page((key, encoding), render, mimetype="application/json", headers=headers)
+
+def clear():
+    PAGE_CACHE.clear()
+
+def stats():
+    return PAGE_CACHE.info()
@@ -0,0 +1,146 @@
+import os
+import re
+import sys
+import threading
+
+# Part of speech lookup over the word lists in res/dict, for suggesting prompts when making a template.
+# The lists get read into one dict (word -> parts of speech it's listed under) the first time a word is
+# looked up. Words that aren't listed as-is get a few simple inflections stripped off (dogs -> dog,
+# walked -> walk, runnin' -> running -> run, ...) and are looked up again.
+DICT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'res', 'dict')
+
+# in order of how likely a word listed under several of them is being used as that one
+PARTS_OF_SPEECH = ("noun", "verb", "adjective", "adverb", "pronoun", "preposition", "conjunction", "interjection")
+# the ones worth making a blank for
+CONTENT_POS = ("noun", "verb", "adjective", "adverb", "interjection")
+# words listed under any of these are glue (you, on, like, ...) even when they're also listed as something else
+FUNCTION_POS = ("pronoun", "preposition", "conjunction")
+# and these aren't in the function lists, but blanking them out makes for a bad madlib
+FUNCTION_WORDS = frozenset((
+    "a", "an", "the", "be", "been", "being", "am", "do", "does", "did", "can", "could", "will", "would",
+    "shall", "should", "may", "might", "must", "have", "has", "had", "not", "just",
+))
+
+# (part of speech, inflection) -> what the template author would type as the prompt
+PROMPTS = {
+    ("noun", ""): "noun",
+    ("noun", "plural"): "plural noun",
+    ("verb", ""): "verb",
+    ("verb", "s"): "verb ending in -s",
+    ("verb", "past"): "verb (past tense)",
+    ("verb", "ing"): "verb ending in -ing",
+    ("adjective", ""): "adjective",
+    ("adjective", "er"): "adjective ending in -er",
+    ("adjective", "est"): "adjective ending in -est",
+    ("adverb", ""): "adverb",
+    ("interjection", ""): "exclamation",
+}
+
+# list file name -> part of speech, for the files that aren't just named after it
+FILE_POS = {"interjections": "interjection"}
+
+ENTRY_RE = re.compile(r"[a-z']+")
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+# word -> lookup() result, words repeat a lot between songs
+_lookups = {}
+
+def load_lexicon(dict_dir=DICT_DIR):
+    # word -> tuple of parts of speech, ordered like PARTS_OF_SPEECH
+    found = {}
+    for f in sorted(os.listdir(dict_dir)):
+        name, ext = os.path.splitext(f)
+        pos = FILE_POS.get(name, name)
+        if ext != ".txt" or pos not in PARTS_OF_SPEECH:
+            continue
+
+        # some of the lists aren't utf-8, and none of the words we want have accents anyway
+        with open(os.path.join(dict_dir, f), "r", encoding="latin-1") as dict_file:
+            for line in dict_file:
+                entry = line.strip().lower()
+                # phrases ("according to") can't match a single sung word
+                if not ENTRY_RE.fullmatch(entry.rstrip("!?.,")):
+                    continue
+                found.setdefault(sys.intern(entry.rstrip("!?.,")), set()).add(pos)
+
+    return {word: tuple(pos for pos in PARTS_OF_SPEECH if pos in parts) for word, parts in found.items()}
+
+def get_lexicon():
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                _lexicon = load_lexicon()
+    return _lexicon
+
+def _stems(word):
+    # (stem, inflection, parts of speech the inflection works for) guesses for an inflected word
+    if word.endswith("in'"):
+        word = word[:-1] + "g"
+        yield word, "", PARTS_OF_SPEECH
+    n = len(word)
+    if word.endswith("ies") and n > 4:
+        yield word[:-3] + "y", "plural", ("noun",)
+        yield word[:-3] + "y", "s", ("verb",)
+    if word.endswith("es") and n > 3:
+        yield word[:-2], "plural", ("noun",)
+        yield word[:-2], "s", ("verb",)
+    if word.endswith("s") and not word.endswith("ss") and n > 2:
+        yield word[:-1], "plural", ("noun",)
+        yield word[:-1], "s", ("verb",)
+    for suffix, inflection, parts in (("ed", "past", ("verb",)), ("ing", "ing", ("verb",)), ("er", "er", ("adjective",)), ("est", "est", ("adjective",))):
+        if not word.endswith(suffix) or n <= len(suffix) + 1:
+            continue
+        stem = word[:-len(suffix)]
+        if suffix != "ing" and stem.endswith("i"):
+            # cried -> cry, happier -> happy
+            yield stem[:-1] + "y", inflection, parts
+        yield stem, inflection, parts
+        yield stem + "e", inflection, parts
+        if len(stem) > 2 and stem[-1] == stem[-2]:
+            # stopped -> stop
+            yield stem[:-1], inflection, parts
+    if word.endswith("ly") and n > 4:
+        # adverbs made from adjectives, quickly -> quick, happily -> happy
+        stem = word[:-2]
+        if stem.endswith("i"):
+            yield stem[:-1] + "y", "ly", ("adjective",)
+        yield stem, "ly", ("adjective",)
+
+def lookup(word):
+    # [(part of speech, inflection), ...] word could be, most likely first. Empty if it's not in any list
+    word = word.lower()
+    found = _lookups.get(word)
+    if found is not None:
+        return found
+
+    lexicon = get_lexicon()
+    found = [(pos, "") for pos in lexicon.get(word, ())]
+    for stem, inflection, parts in _stems(word):
+        for pos in lexicon.get(stem, ()):
+            if pos not in parts:
+                continue
+            if inflection == "ly":
+                pos, inflection = "adverb", ""
+            if (pos, inflection) not in found:
+                found.append((pos, inflection))
+
+    _lookups[word] = found
+    return found
+
+def suggest_prompt(word, found=None):
+    # prompt for a blank in place of word, None if it's not worth making a blank for (or isn't in the lists).
+    # found is what lookup(word) gave, if it's already been looked up (e.g. a Word's pos)
+    if found is None:
+        found = lookup(word)
+    if word.lower() in FUNCTION_WORDS or any(pos in FUNCTION_POS and inflection == "" for pos, inflection in found):
+        return None
+    for pos, inflection in found:
+        if pos in CONTENT_POS:
+            return PROMPTS.get((pos, inflection), PROMPTS[(pos, "")])
+    return None
+
+if __name__ == "__main__":
+    for word in sys.argv[1:]:
+        print(f"{word}: {lookup(word)} -> {suggest_prompt(word)}")
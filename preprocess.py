@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import extract
+import compiled
+import lyricsearch
+from extract import KarTag
+from sqlitedb import SQLiteStore
+
+# Parses every .kar in karaoke_dir across all cores, writes the compiled lyric indexes
+# and adds any new songs to the song index.
+#
+#   python preprocess.py [--force] [--jobs N] [--no-index]
+
+def process_song(filen, force=False):
+    # runs in a worker process
+    start = time.perf_counter()
+    result = {
+        "filen": filen,
+        "ok": False,
+        "error": None,
+        "skipped": False,
+        "n_words": 0,
+        "n_syllables": 0,
+        "tags": {},
+    }
+
+    try:
+        with extract.map_kar(filen) as buf:
+            extract.read_header(buf)
+            result["tags"] = extract.read_kar_tags(buf)
+
+            if not force and compiled.load_compiled(filen) is not None:
+                result["skipped"] = True
+            else:
+                words = list(extract.iter_lyric_words(buf))
+                if len(words) == 0:
+                    raise ValueError("no lyrics found")
+                extract.count_syllables(words)
+                compiled.write_compiled(filen, words)
+                result["n_words"] = len(words)
+                result["n_syllables"] = sum(w.n_syllables for w in words)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+def title_artist(tags, fallback):
+    # the first two @T tags are the title and the artist, anything after that is the sequencer
+    t = [text for text in tags.get(KarTag.TitleArtistSequencer.value, []) if text]
+    title = t[0] if len(t) > 0 else fallback
+    artist = t[1] if len(t) > 1 else ""
+    return title, artist
+
+def update_song_index(CFG, results):
+    try:
+        with open(CFG["song_index"], "rb") as json_file:
+            songs = json.load(json_file)
+    except FileNotFoundError:
+        songs = []
+
+    by_filen = {song["filen"]: song for song in songs}
+    numeric_ids = [int(song["id"]) for song in songs if str(song["id"]).isdigit()]
+    next_id = max(numeric_ids) + 1 if len(numeric_ids) > 0 else 0
+
+    added = 0
+    updated = 0
+    for result in results:
+        if not result["ok"]:
+            continue
+        f = os.path.basename(result["filen"])
+        title, artist = title_artist(result["tags"], os.path.splitext(f)[0])
+
+        song = by_filen.get(f)
+        if song is None:
+            song = {"id": str(next_id), "title": title, "artist": artist, "filen": f}
+            next_id += 1
+            songs.append(song)
+            by_filen[f] = song
+            added += 1
+        else:
+            # never overwrite something a person typed in
+            if not song.get("title"):
+                song["title"] = title
+                updated += 1
+            if not song.get("artist") and artist:
+                song["artist"] = artist
+                updated += 1
+
+    if added > 0 or updated > 0:
+        tmp_filen = CFG["song_index"] + ".tmp"
+        with open(tmp_filen, "w") as json_file:
+            json.dump(songs, json_file, indent=4)
+        os.replace(tmp_filen, CFG["song_index"])
+
+        if CFG.get("storage", "json") == "sqlite":
+            SQLiteStore(CFG.get("sqlite_path", "res/madlibs.db")).set_songs(songs)
+
+    return added, updated
+
+def main():
+    parser = argparse.ArgumentParser(description="compile lyrics for every song in karaoke_dir")
+    parser.add_argument("--force", action="store_true", help="recompile songs that are already up to date")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--no-index", action="store_true", help="don't touch the song index")
+    args = parser.parse_args()
+
+    with open("res/config.json", "rb") as cfg_file:
+        CFG = json.load(cfg_file)
+
+    karaoke_dir = CFG["karaoke_dir"]
+    filens = sorted(
+        os.path.join(karaoke_dir, f) for f in os.listdir(karaoke_dir)
+        if os.path.splitext(f)[-1].lower() == ".kar"
+    )
+    print(f"processing {len(filens)} songs with {args.jobs} workers")
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(process_song, filen, args.force) for filen in filens]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+
+            f = os.path.basename(result["filen"])
+            if not result["ok"]:
+                print(f"  FAILED   {result['seconds']*1000:8.1f}ms  {f}: {result['error']}")
+            elif result["skipped"]:
+                print(f"  ok       {result['seconds']*1000:8.1f}ms  {f} (already compiled)")
+            else:
+                print(f"  ok       {result['seconds']*1000:8.1f}ms  {f} ({result['n_words']} words, {result['n_syllables']} syllables)")
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if not result["ok"]]
+    print(f"done in {elapsed:.2f}s: {len(results) - len(failed)} ok, {len(failed)} failed")
+
+    if not args.no_index:
+        added, updated = update_song_index(CFG, results)
+        print(f"song index: {added} songs added, {updated} fields filled in")
+
+        # everything was just compiled, so this only has to read the compiled indexes
+        with open(CFG["song_index"], "rb") as json_file:
+            lyricsearch.init(CFG, json.load(json_file), background=False)
+
+    if len(failed) > 0:
+        print("failures:")
+        for result in sorted(failed, key=lambda result: result["filen"]):
+            print(f"  {os.path.basename(result['filen'])}: {result['error']}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
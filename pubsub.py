@@ -0,0 +1,162 @@
+import json
+import queue
+import threading
+
+# Tiny in-process publish/subscribe for pushing record changes to browsers over server-sent events.
+# Channels are just names, e.g. "madlib/<id>" or "template/<song id>".
+CHANNELS = {}  # name -> {"seq": n, "subscribers": set of queues}
+CHANNELS_LOCK = threading.Lock()
+
+# a subscriber that falls this far behind gets told to reload instead
+MAX_BACKLOG = 100
+# send a comment line this often so proxies don't close idle streams
+KEEPALIVE = 15
+
+def has_subscribers(name):
+    channel = CHANNELS.get(name)
+    return channel is not None and len(channel["subscribers"]) > 0
+
+def subscribe(name):
+    q = queue.Queue(maxsize=MAX_BACKLOG)
+    with CHANNELS_LOCK:
+        channel = CHANNELS.setdefault(name, {"seq": 0, "subscribers": set()})
+        channel["subscribers"].add(q)
+    return q
+
+def unsubscribe(name, q):
+    with CHANNELS_LOCK:
+        channel = CHANNELS.get(name)
+        if channel is None:
+            return
+        channel["subscribers"].discard(q)
+        if len(channel["subscribers"]) == 0:
+            del CHANNELS[name]
+
+def publish(name, message):
+    # message is any json-able dict, it gets a "seq" number that goes up by one per channel
+    with CHANNELS_LOCK:
+        channel = CHANNELS.get(name)
+        if channel is None:
+            return
+        channel["seq"] += 1
+        message = dict(message, seq=channel["seq"])
+        for q in channel["subscribers"]:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # too slow to keep up, throw away what's queued and have it fetch the whole thing again
+                _drain(q)
+                q.put_nowait({"op": "reset", "seq": channel["seq"]})
+
+def _drain(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            return
+
+def stream(name):
+    # generator of server-sent event lines for one subscriber, stops when the client goes away
+    q = subscribe(name)
+    try:
+        yield "retry: 2000\n\n"
+        while True:
+            try:
+                message = q.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {'reset' if message['op'] == 'reset' else 'patch'}\ndata: {json.dumps(message)}\n\n"
+    finally:
+        unsubscribe(name, q)
+
+def _pointer(path, key):
+    return f"{path}/{str(key).replace('~', '~0').replace('/', '~1')}"
+
+def diff(old, new, path=""):
+    # JSON-patch style ops ("add", "remove", "replace") that turn old into new.
+    # Items added to or removed from lists are add/remove ops of their own (appends go to "/-")
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": _pointer(path, key)})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+            else:
+                ops.extend(diff(old[key], value, _pointer(path, key)))
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        return _diff_list(old, new, path)
+    if old == new and type(old) == type(new):
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+def _diff_list(old, new, path):
+    # the items that are the same at the start and end are left alone, what's left in between is
+    # diffed item by item and the extra items removed or added
+    shortest = min(len(old), len(new))
+    start = 0
+    while start < shortest and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+
+    ops = []
+    n_old = len(old) - end - start
+    n_new = len(new) - end - start
+    common = min(n_old, n_new)
+    for i in range(start, start + common):
+        ops.extend(diff(old[i], new[i], _pointer(path, i)))
+    for _ in range(common, n_old):
+        ops.append({"op": "remove", "path": _pointer(path, start + common)})
+    for i in range(common, n_new):
+        ops.append({"op": "add", "path": _pointer(path, "-" if end == 0 else start + i), "value": new[start + i]})
+    return ops
+
+def apply_patch(doc, ops):
+    # applies ops like the ones from diff to doc (in place) and returns it. Raises ValueError for paths that don't exist
+    for op in ops:
+        keys = [key.replace('~1', '/').replace('~0', '~') for key in op["path"].split('/')[1:]]
+        if len(keys) == 0:
+            if op["op"] == "remove":
+                raise ValueError("can't remove the whole document")
+            doc = op["value"]
+            continue
+
+        try:
+            parent = doc
+            for key in keys[:-1]:
+                parent = parent[int(key) if isinstance(parent, list) else key]
+            last = keys[-1]
+
+            if isinstance(parent, list):
+                idx = len(parent) if last == '-' else int(last)
+                if op["op"] == "add":
+                    if idx > len(parent):
+                        raise IndexError(idx)
+                    parent.insert(idx, op["value"])
+                elif op["op"] == "replace":
+                    parent[idx] = op["value"]
+                elif op["op"] == "remove":
+                    del parent[idx]
+                else:
+                    raise ValueError(f"unknown op {op['op']!r}")
+            elif isinstance(parent, dict):
+                if op["op"] == "add":
+                    parent[last] = op["value"]
+                elif op["op"] == "replace":
+                    if last not in parent:
+                        raise KeyError(last)
+                    parent[last] = op["value"]
+                elif op["op"] == "remove":
+                    del parent[last]
+                else:
+                    raise ValueError(f"unknown op {op['op']!r}")
+            else:
+                raise TypeError(op["path"])
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"bad path {op['path']!r}") from e
+    return doc
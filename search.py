@@ -0,0 +1,127 @@
+import re
+import bisect
+import threading
+import unicodedata
+
+# Search over song titles and artists. Every word of a title/artist is a token, a query matches a song
+# when each query word matches one of its tokens exactly, as a prefix, or with a typo or two.
+SEARCH = {
+    "songs": [],      # same order as db's songs_by_artist, postings hold indices into this
+    "postings": {},   # token -> sorted list of song indices
+    "tokens": [],     # every token, sorted, for prefix lookups
+    "trigrams": {},   # trigram -> set of tokens, for finding typo candidates
+}
+SEARCH_LOCK = threading.Lock()
+
+# how much each kind of match is worth when ranking
+EXACT, PREFIX, FUZZY = 3, 2, 1
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    # lowercase, accents dropped, split on anything that isn't a letter or digit
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return TOKEN_RE.findall(text.replace("'", ""))
+
+def _trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+def build_index(songs):
+    postings = {}
+    for i, song in enumerate(songs):
+        for token in set(tokenize(song.get("title", "")) + tokenize(song.get("artist", ""))):
+            postings.setdefault(token, []).append(i)
+
+    trigrams = {}
+    for token in postings:
+        for trigram in _trigrams(token):
+            trigrams.setdefault(trigram, set()).add(token)
+
+    # swap everything in at once so searches in flight see either the old or the new index
+    with SEARCH_LOCK:
+        SEARCH["songs"] = songs
+        SEARCH["postings"] = postings
+        SEARCH["tokens"] = sorted(postings)
+        SEARCH["trigrams"] = trigrams
+
+def _max_typos(token):
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+def _edit_distance(a, b, limit):
+    # levenshtein distance, gives up (returns limit + 1) as soon as it's over limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j-1] + 1, prev[j-1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+def _matches(index, query_token):
+    # token -> how good a match it is for query_token
+    matches = {}
+
+    tokens = index["tokens"]
+    start = bisect.bisect_left(tokens, query_token)
+    for token in tokens[start:]:
+        if not token.startswith(query_token):
+            break
+        matches[token] = EXACT if token == query_token else PREFIX
+
+    max_typos = _max_typos(query_token)
+    if max_typos > 0:
+        trigrams = _trigrams(query_token)
+        shared = {}
+        for trigram in trigrams:
+            for token in index["trigrams"].get(trigram, ()):
+                shared[token] = shared.get(token, 0) + 1
+        # every typo can knock out up to 3 trigrams
+        min_shared = len(trigrams) - 3 * max_typos
+        for token, n in shared.items():
+            if token in matches or n < min_shared:
+                continue
+            if _edit_distance(query_token, token, max_typos) <= max_typos:
+                matches[token] = FUZZY
+    return matches
+
+def search(query, page=1, per_page=50, keep=None):
+    # (songs on this page, total number of matches). Best matches first, ties stay in artist order.
+    # keep(song) can filter the results, e.g. to songs that have a template
+    with SEARCH_LOCK:
+        index = dict(SEARCH)
+
+    query_tokens = tokenize(query)
+    if len(query_tokens) == 0:
+        ranked = index["songs"]
+    else:
+        scores = None
+        for query_token in query_tokens:
+            token_scores = {}
+            for token, score in _matches(index, query_token).items():
+                for i in index["postings"][token]:
+                    if token_scores.get(i, 0) < score:
+                        token_scores[i] = score
+
+            # every query word has to match something
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {i: score + token_scores[i] for i, score in scores.items() if i in token_scores}
+            if len(scores) == 0:
+                break
+
+        ranked = [index["songs"][i] for i in sorted(scores, key=lambda i: (-scores[i], i))]
+
+    if keep is not None:
+        ranked = [song for song in ranked if keep(song)]
+
+    start = (max(page, 1) - 1) * per_page
+    return ranked[start:start + per_page], len(ranked)
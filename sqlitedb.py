@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS songs (
+    id TEXT PRIMARY KEY,
+    artist TEXT,
+    title TEXT,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS templates (
+    song_id TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    is_empty INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS madlibs (
+    id TEXT PRIMARY KEY,
+    song TEXT,
+    song_name TEXT,
+    singer_name TEXT,
+    author_name TEXT,
+    body TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS madlibs_song ON madlibs (song);
+CREATE INDEX IF NOT EXISTS madlibs_updated ON madlibs (updated);
+CREATE INDEX IF NOT EXISTS madlibs_created ON madlibs (created);
+"""
+
+# columns that can be used to sort the madlib listing
+NOCASE_SORTS = ("song_name", "singer_name", "author_name")
+TIME_SORTS = ("updated", "created")
+
+class SQLiteStore:
+    # Same data as the res/ json files, stored in one sqlite database.
+    # sqlite connections can't be shared between threads so each thread gets its own.
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.conn().executescript(SCHEMA)
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # autocommit mode, transactions are started explicitly in transaction()
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.conn())
+
+    def _meta(self, key, default=None):
+        row = self.conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row is not None else default
+
+    # songs
+
+    def songs_version(self):
+        return self._meta("songs_version", "0")
+
+    def get_songs(self):
+        return [json.loads(row["body"]) for row in self.conn().execute("SELECT body FROM songs")]
+
+    def set_songs(self, songs):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM songs")
+            conn.executemany(
+                "INSERT INTO songs (id, artist, title, body) VALUES (?, ?, ?, ?)",
+                [(song["id"], song.get("artist"), song.get("title"), json.dumps(song)) for song in songs],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('songs_version', ?)",
+                (str(time.time_ns()),),
+            )
+
+    # templates
+
+    def get_template_str(self, song_id):
+        row = self.conn().execute("SELECT body FROM templates WHERE song_id = ?", (song_id,)).fetchone()
+        return row["body"] if row is not None else "{}"
+
+    def write_template(self, song_id, new_json, updated=None):
+        with self.transaction() as conn:
+            self._put_template(conn, song_id, new_json, updated)
+
+    def update_template(self, song_id, update):
+        # read-modify-write in one transaction, returns (old, new)
+        with self.transaction() as conn:
+            row = conn.execute("SELECT body FROM templates WHERE song_id = ?", (song_id,)).fetchone()
+            old = json.loads(row["body"]) if row is not None else {}
+            new = update(old)
+            self._put_template(conn, song_id, new)
+        return old, new
+
+    def _put_template(self, conn, song_id, new_json, updated=None):
+        # the version number on its own doesn't make a template
+        is_empty = set(new_json) <= {"version"}
+        conn.execute(
+            "INSERT OR REPLACE INTO templates (song_id, body, is_empty, updated) VALUES (?, ?, ?, ?)",
+            (song_id, json.dumps(new_json), 1 if is_empty else 0, updated or time.time()),
+        )
+
+    def template_ids(self):
+        return {row["song_id"] for row in self.conn().execute("SELECT song_id FROM templates WHERE is_empty = 0")}
+
+    # madlibs
+
+    def get_madlib_str(self, madlib_id):
+        row = self.conn().execute("SELECT body FROM madlibs WHERE id = ?", (madlib_id,)).fetchone()
+        return row["body"] if row is not None else "{}"
+
+    def write_madlib(self, madlib, created=None, updated=None):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT created FROM madlibs WHERE id = ?", (madlib["id"],)).fetchone()
+            if row is not None:
+                created = row["created"]
+            self._put_madlib(conn, madlib, created, updated)
+
+    def update_madlib(self, madlib_id, update):
+        # read-modify-write in one transaction, returns (old, new)
+        with self.transaction() as conn:
+            row = conn.execute("SELECT body, created FROM madlibs WHERE id = ?", (madlib_id,)).fetchone()
+            old = json.loads(row["body"]) if row is not None else {}
+            new = update(old)
+            self._put_madlib(conn, new, row["created"] if row is not None else None)
+        return old, new
+
+    def _put_madlib(self, conn, madlib, created=None, updated=None):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO madlibs (id, song, song_name, singer_name, author_name, body, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                madlib["id"], str(madlib.get("song") or ""), str(madlib.get("song_name") or ""),
+                str(madlib.get("singer_name") or ""), str(madlib.get("author_name") or ""), json.dumps(madlib),
+                created or madlib.get("created", now), updated or now,
+            ),
+        )
+
+    def get_madlibs(self):
+        return [json.loads(row["body"]) for row in self.conn().execute("SELECT body FROM madlibs")]
+
+    def list_madlibs(self, page, per_page, sort, reverse):
+        if sort in NOCASE_SORTS:
+            order = f"{sort} COLLATE NOCASE"
+        elif sort in TIME_SORTS:
+            order = sort
+        else:
+            order = "updated"
+        order += " DESC" if reverse else " ASC"
+
+        conn = self.conn()
+        rows = conn.execute(
+            "SELECT id, song, song_name, singer_name, author_name, created, updated FROM madlibs "
+            f"ORDER BY {order} LIMIT ? OFFSET ?",
+            (per_page, (max(page, 1) - 1) * per_page),
+        ).fetchall()
+        total = conn.execute("SELECT COUNT(*) FROM madlibs").fetchone()[0]
+        return [dict(row) for row in rows], total
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front so two writers can't interleave a read-modify-write
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+def import_json(CFG, store):
+    # one-shot copy of the res/ json layout into the database
+    with open(CFG["song_index"], "rb") as json_file:
+        songs = json.load(json_file)
+    store.set_songs(songs)
+    print(f"imported {len(songs)} songs")
+
+    template_dir = CFG["madlib_template_dir"]
+    n_templates = 0
+    for f in os.listdir(template_dir):
+        song_id, ext = os.path.splitext(f)
+        if ext != ".json":
+            continue
+        filen = os.path.join(template_dir, f)
+        with open(filen) as template_file:
+            store.write_template(song_id, json.load(template_file), updated=os.path.getmtime(filen))
+        n_templates += 1
+    print(f"imported {n_templates} templates")
+
+    madlib_dir = CFG["filled_madlib_dir"]
+    n_madlibs = 0
+    for f in os.listdir(madlib_dir):
+        if os.path.splitext(f)[-1] != ".json":
+            continue
+        filen = os.path.join(madlib_dir, f)
+        with open(filen) as madlib_file:
+            madlib = json.load(madlib_file)
+        mtime = os.path.getmtime(filen)
+        store.write_madlib(madlib, created=madlib.get("created", mtime), updated=mtime)
+        n_madlibs += 1
+    print(f"imported {n_madlibs} madlibs")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("usage: python sqlitedb.py import")
+        sys.exit(1)
+
+    with open("res/config.json", "rb") as cfg_file:
+        CFG = json.load(cfg_file)
+    import_json(CFG, SQLiteStore(CFG.get("sqlite_path", "res/madlibs.db")))
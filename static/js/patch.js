@@ -0,0 +1,172 @@
+// Live updates from the server (see pubsub.py). Saves send X-Client-Id so our own changes can be skipped
+const clientId = Math.random().toString(36).slice(2);
+
+function applyPatch(doc, ops) {
+    for (const op of ops) {
+        const keys = op.path.split("/").slice(1).map(k => k.replace(/~1/g, "/").replace(/~0/g, "~"));
+        if (keys.length === 0) {
+            doc = op.value;
+            continue;
+        }
+
+        let parent = doc;
+        for (const key of keys.slice(0, -1)) {
+            parent = parent[key];
+        }
+        const last = keys[keys.length - 1];
+        if (op.op === "remove") {
+            if (Array.isArray(parent)) {
+                parent.splice(Number(last), 1);
+            } else {
+                delete parent[last];
+            }
+        } else if (op.op === "add" && Array.isArray(parent)) {
+            parent.splice(last === "-" ? parent.length : Number(last), 0, op.value);
+        } else {
+            parent[last] = op.value;
+        }
+    }
+    return doc;
+}
+
+function pointer(path, key) {
+    return `${path}/${String(key).replace(/~/g, "~0").replace(/\//g, "~1")}`;
+}
+
+// same as pubsub.diff on the server
+function diff(old, now, path = "") {
+    const isObject = x => x !== null && typeof x === "object" && !Array.isArray(x);
+    if (isObject(old) && isObject(now)) {
+        const ops = [];
+        for (const key in old) {
+            if (!(key in now)) {
+                ops.push({ op: "remove", path: pointer(path, key) });
+            }
+        }
+        for (const key in now) {
+            if (now[key] === undefined) {
+                continue;
+            }
+            if (!(key in old) || old[key] === undefined) {
+                ops.push({ op: "add", path: pointer(path, key), value: now[key] });
+            } else {
+                ops.push(...diff(old[key], now[key], pointer(path, key)));
+            }
+        }
+        return ops;
+    }
+    if (Array.isArray(old) && Array.isArray(now)) {
+        return diffArray(old, now, path);
+    }
+    if (JSON.stringify(old) === JSON.stringify(now)) {
+        return [];
+    }
+    return [{ op: "replace", path: path, value: now }];
+}
+
+// Items added or removed are their own add/remove ops (appends go to "/-"), so redoing them on top of
+// someone else's changes (see patchSaver) doesn't throw away what they added
+function diffArray(old, now, path) {
+    const same = (a, b) => JSON.stringify(a) === JSON.stringify(b);
+    const shortest = Math.min(old.length, now.length);
+    let start = 0;
+    while (start < shortest && same(old[start], now[start])) {
+        start++;
+    }
+    let end = 0;
+    while (end < shortest - start && same(old[old.length - 1 - end], now[now.length - 1 - end])) {
+        end++;
+    }
+
+    const ops = [];
+    const nOld = old.length - end - start;
+    const nNow = now.length - end - start;
+    const common = Math.min(nOld, nNow);
+    for (let i = start; i < start + common; i++) {
+        ops.push(...diff(old[i], now[i], pointer(path, i)));
+    }
+    for (let i = common; i < nOld; i++) {
+        ops.push({ op: "remove", path: pointer(path, start + common) });
+    }
+    for (let i = common; i < nNow; i++) {
+        ops.push({ op: "add", path: pointer(path, end === 0 ? "-" : start + i), value: now[start + i] });
+    }
+    return ops;
+}
+
+// Saves only what changed since the last save, with the version it was based on. One request at a time,
+// anything changed while one is in flight goes in the next. If someone else saved first (409) our changes
+// get redone on top of theirs and sent again.
+function patchSaver(url, saved, getState, setState) {
+    saved = structuredClone(saved);
+    let running = null;
+    let again = false;
+
+    // resolves once everything up to now is saved
+    function save() {
+        if (running !== null) {
+            again = true;
+            return running;
+        }
+        running = send().finally(() => { running = null; });
+        return running;
+    }
+
+    async function send() {
+        try {
+            do {
+                again = false;
+                const state = getState();
+                const ops = diff(saved, state).filter(op => op.path !== "/version");
+                if (ops.length === 0) {
+                    continue;
+                }
+
+                const res = await fetch(url, {
+                    method: "PATCH",
+                    headers: {
+                        "Content-Type": "application/json",
+                        "X-Client-Id": clientId,
+                    },
+                    body: JSON.stringify({ version: saved.version || 0, ops: ops }),
+                });
+                if (res.status === 409) {
+                    saved = (await res.json()).current;
+                    setState(applyPatch(structuredClone(saved), ops));
+                    again = true;
+                } else if (!res.ok) {
+                    // our copy doesn't line up with the server's anymore, start over from what's saved
+                    window.location.reload();
+                    return;
+                } else {
+                    const version = (await res.json()).version;
+                    // a newer version might have come in over watch() already
+                    saved = applyPatch(saved, structuredClone(ops));
+                    saved.version = Math.max(saved.version || 0, version);
+                    getState().version = saved.version;
+                }
+            } while (again);
+        } catch (error) {
+            console.error(error);
+        }
+    }
+
+    // changes someone else made, so they don't look like ours
+    function remote(ops) {
+        saved = applyPatch(saved, structuredClone(ops));
+    }
+
+    return { save, remote };
+}
+
+function watch(url, onPatch, onReset) {
+    const events = new EventSource(url);
+    events.addEventListener("patch", e => {
+        const message = JSON.parse(e.data);
+        if (message.source !== clientId) {
+            onPatch(message.ops);
+        }
+    });
+    events.addEventListener("reset", e => onReset());
+    return events;
+}